@@ -11,7 +11,7 @@ __author__ = "Siyao Chen"
 __email__ = "schen245@fordham.edu"
 
 
-import re,requests,random
+import re,requests
 import ast
 import urllib.request
 from bs4 import BeautifulSoup
@@ -22,10 +22,23 @@ import re
 from fake_useragent import UserAgent
 from fake_useragent import FakeUserAgentError
 import math
-from selenium import webdriver
-from selenium.webdriver.common.keys import Keys
+import os
+import logging
+import threading
+from contextlib import nullcontext
+from proxy_pool import proxy_pool
+from http_session import session_pool
+from site_index import site_index
+import prod_parser
+import result_schema
+from price_store import page_digest
+from checkpoint import job_checkpoint, checkpoint_path
+from metrics import timed_parse, profiled
+from fetch_policy import fetch_policy, fetch_blocked, OK, THROTTLED, BLOCKED
 
 
+logger = logging.getLogger('homedepot_crawler')
+
 
 # The purpose of this class is to build a search engine (nested dictionary) to get the source url -
 # -for specific sub_department and department. It also grab the hierarchical department structure from site-map -
@@ -35,9 +48,41 @@ from selenium.webdriver.common.keys import Keys
 # [In]: dep_dict["Furniture"]["Bedroom Furniture"]['Nightstands']
 # [Out]:'https://www.homedepot.com/b/Furniture-Bedroom-Furniture-Nightstands/N-5yc1vZceum'
 class homedepot_site_map:
+
+    # Every absolute link is built from site_url, so the crawler can be pointed at a local stand-in site.
+    site_url = 'https://www.homedepot.com'
+
+    # The proxy pool is shared by every instance of the classes, so the gatherproxy list is only downloaded once -
+    # -and then refreshed in the background by the pool itself instead of on every page fetch.
+    # Point proxy_list_url to a local stand-in list to test the pool without gatherproxy.com.
+    proxy_list_url = 'http://gatherproxy.com/proxylist/anonymity/?t=Elite'
+    shared_proxy_pool = None
+    _proxy_pool_lock = threading.Lock()
+    # The session pool is shared the same way, so keep-alive connections are reused across pages and instances.
+    # session_pool_size should be at least the crawl concurrency. request_timeout is the read timeout and -
+    # -connect_timeout the connect timeout of every request; page fetches get them through the default fetch -
+    # -policy, so a shared_fetch_policy set by hand brings its own timeout.
+    session_pool_size = 20
+    request_timeout = 30
+    connect_timeout = 5
+    shared_session_pool = None
+    _session_pool_lock = threading.Lock()
+    # The fetch policy (per-host adaptive rate limit, backoff, timeouts, block-page detection) is shared the same way.
+    shared_fetch_policy = None
+    _fetch_policy_lock = threading.Lock()
+    # Set response_cache to a response_cache (response_cache.py) to keep pages on disk between runs, or to replay -
+    # -a recorded crawl with no network at all.
+    response_cache = None
+    # Set site_index to a site_index (site_index.py) to load dep_dict and the brand dictionaries from disk and -
+    # -share them across crawler instances and runs; stale entries are refetched one by one on their ttl.
+    site_index = None
+    # A crawl engine can set a host_limiter to cap the number of concurrent requests (globally and per host).
+    host_limiter = None
+    # Set metrics to a crawl_metrics (metrics.py) to time every request, proxy try and parse; None turns it off.
+    metrics = None
     
     def __init__(self):
-        self.url = 'https://www.homedepot.com/c/site_map'
+        self.url = self.site_url + '/c/site_map'
     # Using the site-map of the website as source url.
     
     def get_random_header(self):
@@ -64,41 +109,179 @@ class homedepot_site_map:
         return gatherproxy_list
     
     # Gatherproxy.com provides us free proxies for scraping. We just need to scrape the list and store into a list.
-    def gatherproxy_resp(self):
-        url = 'http://gatherproxy.com/proxylist/anonymity/?t=Elite'
+    def gatherproxy_resp(self, url=None):
+        if url is None:
+            url = self.proxy_list_url
         header={'User-Agent':'Mozilla/5.0 (Windows NT 10.0; Win64; x64)                AppleWebKit/537.36 (KHTML, like Gecko) Chrome/51.0.2704.103 Safari/537.36'}
+        start = time.perf_counter()
         try:
-            r = requests.get(url, headers = header)
+            r = self.get_session_pool().get(url, headers = header)
             lines = r.text.splitlines()
-        except:
+        except Exception as e:
+            if self.metrics is not None:
+                self.metrics.proxy_list(time.perf_counter() - start, 0, error=type(e).__name__)
             gatherproxy_list = []
             return gatherproxy_list
 
         gatherproxy_list = self.parse_gp(lines)
+        if self.metrics is not None:
+            self.metrics.proxy_list(time.perf_counter() - start, len(gatherproxy_list))
         return gatherproxy_list
     
-    # Built my own get_html() function to get respond of a web page and parse the html file.
-    def get_html(self, url):
+    # get_proxy_pool() builds the shared proxy pool on first use with gatherproxy_resp() as its loader.
+    def get_proxy_pool(self):
+        with homedepot_site_map._proxy_pool_lock:
+            if homedepot_site_map.shared_proxy_pool is None:
+                homedepot_site_map.shared_proxy_pool = proxy_pool(self.gatherproxy_resp)
+        return homedepot_site_map.shared_proxy_pool
+
+    # get_session_pool() builds the shared session pool on first use.
+    def get_session_pool(self):
+        with homedepot_site_map._session_pool_lock:
+            if homedepot_site_map.shared_session_pool is None:
+                homedepot_site_map.shared_session_pool = session_pool(pool_maxsize=self.session_pool_size,
+                                                                      timeout=(self.connect_timeout,
+                                                                               self.request_timeout))
+        return homedepot_site_map.shared_session_pool
+
+    def host_slot(self, url):
+        if self.host_limiter is None:
+            return nullcontext()
+        return self.host_limiter.slot(url)
+
+    # fetch_html() is the network part of get_html() shared by both classes. It picks the fastest healthy proxy -
+    # -from the pool for every try and reports the outcome back, so dead proxies are evicted instead of retried.
+    # Requests go through the pooled session for (proxy, location), which already carries the store's cookies.
+    # With a response_cache, a cached page is returned before any proxy or connection is touched.
+    def fetch_html(self, url, params=None, location=None):
+        cookies = self.cookies[location] if location is not None else None
+        if self.response_cache is not None:
+            html = self.response_cache.get(url, params, cookies)
+            if html is not None:
+                if self.metrics is not None:
+                    self.metrics.cache_hit(url)
+                return html
         try:
             header = {'User-Agent':ua.random} 
         except:
             header={'User-Agent':'Mozilla/5.0 (Windows NT 10.0; Win64; x64)        AppleWebKit/537.36 (KHTML, like Gecko) Chrome/51.0.2704.103 Safari/537.36'}
-        # If connection failed using one of the proxy, we'll reconnect for 4 times using other proxies.
-        retry_count = 5
-        while retry_count > 0:
+        pool = self.get_proxy_pool()
+        sessions = self.get_session_pool()
+        if self.metrics is None:
+            request = self._fetch_with_retry(url, header, pool, sessions, params, location, cookies)[0]
+        else:
+            request = self._fetch_measured(url, header, pool, sessions, params, location, cookies)
+        if self.response_cache is not None and request.status_code == 200:
+            self.response_cache.put(url, request.text, params, cookies)
+        return request.text
+
+    # Only the request itself holds a host slot: the rate-limit wait and the backoff between tries sleep outside it, -
+    # -so a throttled host does not tie up every fetch_limiter slot with sleeping threads. timing collects the time -
+    # -spent waiting for slots ('wait') and when the last request got its slot ('sent').
+    def _send(self, sessions, url, timing, **kwargs):
+        queued = time.perf_counter()
+        with self.host_slot(url):
+            timing['sent'] = time.perf_counter()
+            timing['wait'] += timing['sent'] - queued
+            return sessions.get(url, **kwargs)
+
+    # _fetch_with_retry() returns the response, the number of proxies tried and 'proxy' or 'direct' for how it -
+    # -was fetched in the end. Every response is classified by the fetch policy first: a throttled or blocked -
+    # -response is retried after a jittered backoff instead of being handed to the parser, and a proxy the site -
+    # -refused has its circuit breaker tripped. If every try was refused, fetch_blocked is raised.
+    def _fetch_with_retry(self, url, header, pool, sessions, params, location, cookies, timing=None):
+        policy = self.get_fetch_policy()
+        timing = timing if timing is not None else {'wait': 0.0}
+        tries = 0
+        refused = None
+        # If connection failed using one of the proxy, we'll reconnect up to max_tries times using other proxies.
+        for attempt in range(policy.max_tries):
+            proxy = pool.get_proxy()
+            if proxy is None:
+                break
+            tries += 1
+            policy.wait(url)
+            timing['sent'] = time.perf_counter()
             try:
                 # Pass in proxies and headers to request module to confuse anti-crawler.
-                request= requests.get(url, proxies={'http':'http://'+ random.choice(gatherproxy_resp())},headers = header)
-                html = request.text
-                #Bs4 can use different HTML parsers, each of which has its advantages and disadvantages.
-                #The default is to use Python's integrated HTML parser in the html.parser module.
-                #lxml module is better for websites with dynamic elements.
-                soup = BeautifulSoup(html, 'lxml')
-                return soup
+                request= self._send(sessions, url, timing, proxy=proxy, location=location, cookies=cookies,
+                                    headers = header, params=params, timeout=policy.timeout)
             except Exception:
-                retry_count -= 1
-        request= requests.get(url, headers = header)
-        html = request.text
+                pool.report(proxy, False)
+                if self.metrics is not None:
+                    self.metrics.proxy_attempt(proxy, False, time.perf_counter() - timing['sent'])
+                if proxy in pool.evicted:
+                    sessions.discard(proxy)
+                time.sleep(policy.delay(attempt))
+                continue
+            verdict = policy.classify(request)
+            policy.record(url, verdict, request)
+            if self.metrics is not None:
+                self.metrics.proxy_attempt(proxy, verdict == OK, time.perf_counter() - timing['sent'])
+                self.metrics.verdict(url, verdict, request.status_code, 'proxy')
+            if verdict == OK:
+                pool.report(proxy, True, time.perf_counter() - timing['sent'])
+                return request, tries, 'proxy'
+            if verdict in (THROTTLED, BLOCKED):
+                pool.trip(proxy, policy.proxy_cooldown)
+            refused = request
+            time.sleep(policy.delay(attempt, request))
+        # Without a usable proxy we connect directly, with the same backoff and the same status check; a timeout or -
+        # -a reset connection is retried like a refused response.
+        error = None
+        for attempt in range(policy.direct_tries):
+            policy.wait(url)
+            try:
+                request= self._send(sessions, url, timing, location=location, cookies=cookies, headers = header,
+                                    params=params, timeout=policy.timeout)
+            except requests.RequestException as e:
+                error = e
+                if attempt + 1 < policy.direct_tries:
+                    time.sleep(policy.delay(attempt))
+                continue
+            verdict = policy.classify(request)
+            policy.record(url, verdict, request)
+            if self.metrics is not None:
+                self.metrics.verdict(url, verdict, request.status_code, 'direct')
+            if verdict == OK:
+                return request, tries, 'direct'
+            refused = request
+            if attempt + 1 < policy.direct_tries:
+                time.sleep(policy.delay(attempt, request))
+        if refused is None:
+            raise error
+        raise fetch_blocked(url, policy.classify(refused), refused.status_code)
+
+    # get_fetch_policy() builds the shared fetch policy (fetch_policy.py) with its defaults and our timeouts on first use.
+    def get_fetch_policy(self):
+        with homedepot_site_map._fetch_policy_lock:
+            if homedepot_site_map.shared_fetch_policy is None:
+                homedepot_site_map.shared_fetch_policy = fetch_policy(timeout=(self.connect_timeout,
+                                                                               self.request_timeout))
+        return homedepot_site_map.shared_fetch_policy
+
+    # _fetch_measured() is the instrumented fetch: the time waiting for host slots is recorded apart from the -
+    # -request itself, which includes every proxy retry, the backoff and the direct fallback.
+    def _fetch_measured(self, url, header, pool, sessions, params, location, cookies):
+        timing = {'wait': 0.0}
+        start = time.perf_counter()
+        try:
+            request, tries, via = self._fetch_with_retry(url, header, pool, sessions, params, location, cookies,
+                                                         timing)
+        except Exception as e:
+            self.metrics.request(url, None, time.perf_counter() - start - timing['wait'], 0, 0, 'direct',
+                                 timing['wait'], error=type(e).__name__)
+            raise
+        self.metrics.request(url, request.status_code, time.perf_counter() - start - timing['wait'],
+                             len(request.content), tries, via, timing['wait'])
+        return request
+
+    # Built my own get_html() function to get respond of a web page and parse the html file.
+    def get_html(self, url):
+        html = self.fetch_html(url)
+        #Bs4 can use different HTML parsers, each of which has its advantages and disadvantages.
+        #The default is to use Python's integrated HTML parser in the html.parser module.
+        #lxml module is better for websites with dynamic elements.
         soup = BeautifulSoup(html, 'lxml')
         return soup
     
@@ -110,13 +293,13 @@ class homedepot_site_map:
     #But for some special cases like "Furniture" ("Bedroom Furniture"), we have to add a level to our dict.
     def get_dep_dict(self, url): 
         soup = self.get_html(url)
-        department_all_raw = soup.find_all('ul', attrs= {"class": "list list--type-plain u__text-align--left "})[:29]
+        department_all_raw = soup.find_all('ul', attrs= {"class": "list list--type-plain u__text-align--left"})[:29]
         dep_sub_name_all = []
         dep_sub_link_all = []
         for i in department_all_raw:
             dep_sub_name = []
             dep_sub_link = []
-            for j in i.find_all('li', {"class": "list__item list__item--padding-none "}):
+            for j in i.find_all('li', {"class": "list__item list__item--padding-none"}):
                 if j.text.strip() != "":
                     dep_sub_name.append(j.text.strip())
                     try:
@@ -141,13 +324,19 @@ class homedepot_site_map:
     # [In]: dep_dict["Furniture"]["Bedroom Furniture"]["Mattresses"]
     # [Out]: 'https://www.homedepot.com/b/Furniture-Bedroom-Furniture-Mattresses/N-5yc1vZc7oe'
     def run(self):
+        if self.site_index is not None:
+            return self.site_index.get_dep_dict(self.crawl_site_map)
+        return self.crawl_site_map()
+
+    # crawl_site_map() always fetches the site map, run() only calls it when the site_index has no fresh copy.
+    def crawl_site_map(self):
         dep_dict = self.get_dep_dict(self.url)
         url_current = dep_dict["Furniture"]["Bedroom Furniture"]
         soup = self.get_html(url_current)
         dep_sub_2_ls_raw = soup.find('ul', attrs={"data-refinement": "Department"})
         dep_sub_2_name = [i.find('a').text.strip().split("(")[0].strip() for i in dep_sub_2_ls_raw .find_all('li')]
         dep_sub_2_name.pop(0)
-        dep_sub_2_link = ["https://www.homedepot.com" + i.find('a').attrs["href"] for i in dep_sub_2_ls_raw .find_all('li')]
+        dep_sub_2_link = [self.site_url + i.find('a').attrs["href"] for i in dep_sub_2_ls_raw .find_all('li')]
         dep_sub_2_link.pop(0)
         dep_dict["Furniture"]["Bedroom Furniture"] = dict(zip (dep_sub_2_name, dep_sub_2_link))
         return dep_dict
@@ -167,11 +356,39 @@ class homedepot_site_map:
 class homedepot_crawler(homedepot_site_map):
     
     # __init__ method here will pass in the department, sub_department, brand, location information from instances of the class.
-    def __init__(self, department, sub_department, brand, location):
+    # prod_parser picks the listing page parser: 'lxml' is the fast extractor in prod_parser.py, 'bs4' is the -
+    # -original BeautifulSoup get_prod_info(). Both return the same lists, so they can be compared page by page.
+    prod_parser = 'lxml'
+
+    # load_more_source picks how the "load more" (Mattresses) pages are crawled: 'http' fetches the extra result -
+    # -pages directly with the "Nao" parameter, 'browser' clicks the button in a pooled headless Chrome.
+    load_more_source = 'http'
+    load_more_page_size = 24
+    chromedriver_path = None
+    driver_pool_size = 2
+    shared_driver_pool = None
+    _driver_pool_lock = threading.Lock()
+
+    # With a checkpoint_dir, every finished page is written to a per-job checkpoint (checkpoint.py) and a restarted -
+    # -run picks up where it stopped. A failed page is requeued up to page_retries times instead of ending the loop.
+    checkpoint_dir = None
+    page_retries = 2
+
+    # The columns of the result, in order (see result_schema.py for their types).
+    columns = result_schema.COLUMNS
+
+    # map_pages() uses a page_executor handed in by a crawl engine to fetch the "Nao" pages concurrently.
+    page_executor = None
+
+    # dep_dict can be passed in directly, otherwise the global search engine built in __main__ is used.
+    def __init__(self, department, sub_department, brand, location, dep_dict=None):
+        self.dep_dict = dep_dict
         self.department = department#.replace(" ", "-").lower()
         self.sub_department = sub_department#.lower()
         self.brand = brand.lower()
         self.location = location
+        self.complete = True
+        self.failed_pages = []
         #The cookies are collected from the website to determine the specific store we want to crawl by passing in requests.
         self.cookies = {10022: dict(THD_PERSIST='C4%3D6177%2BManhattan%2059th%20Street%20-%20New%20York%2C%20NY%2B%3A%3BC4_EXP%3D1572030922%3A%3BC24%3D10022%3A%3BC24_EXP%3D1572030922%3A%3BC34%3D32.1%3A%3BC34_EXP%3D1540582116%3A%3BC39%3D1%3B8%3A00-20%3A00%3B2%3B7%3A00-22%3A00%3B3%3B7%3A00-22%3A00%3B4%3B7%3A00-22%3A00%3B5%3B7%3A00-22%3A00%3B6%3B7%3A00-22%3A00%3B7%3B7%3A00-22%3A00%3A%3BC39_EXP%3D1540498522'),
                   75209: dict(THD_PERSIST='C4%3D589%2BLemmon%20Ave%20-%20Dallas%2C%20TX%2B%3A%3BC4_EXP%3D1572032392%3A%3BC24%3D75209%3A%3BC24_EXP%3D1572032392%3A%3BC34%3D32.1%3A%3BC34_EXP%3D1540582829%3A%3BC39%3D1%3B8%3A00-20%3A00%3B2%3B6%3A00-22%3A00%3B3%3B6%3A00-22%3A00%3B4%3B6%3A00-22%3A00%3B5%3B6%3A00-22%3A00%3B6%3B6%3A00-22%3A00%3B7%3B6%3A00-22%3A00%3A%3BC39_EXP%3D1540499992')}
@@ -179,6 +396,7 @@ class homedepot_crawler(homedepot_site_map):
     # Using the search enginee(dep_dict) built above, we can pass in the department and sub_department name to get -
     # - url for further crawling (brands).
     def get_source_url(self):
+        dep_dict = self.dep_dict if self.dep_dict is not None else globals()['dep_dict']
 
         if self.department == 'Bedroom Furniture':
             source_url = dep_dict["Furniture"][self.department][self.sub_department]
@@ -191,71 +409,60 @@ class homedepot_crawler(homedepot_site_map):
     # Adding "browsestoreoption = 1" to the source url, we will only get the specific products from the selected stores.
     # While adding "browsestoreoption = 2" to the source url, we will get all the products from all the stores.
     def get_html(self, url, browsestoreoption):
-        #ua = self.get_random_header()
-        try:
-            header = {'User-Agent':ua.random} 
-        except:
-            header={'User-Agent':'Mozilla/5.0 (Windows NT 10.0; Win64; x64)        AppleWebKit/537.36 (KHTML, like Gecko) Chrome/51.0.2704.103 Safari/537.36'}
-        payload = {'browsestoreoption': browsestoreoption}
 #         cookies = {10022: dict(THD_PERSIST='C4%3D6177%2BManhattan%2059th%20Street%20-%20New%20York%2C%20NY%2B%3A%3BC4_EXP%3D1572030922%3A%3BC24%3D10022%3A%3BC24_EXP%3D1572030922%3A%3BC34%3D32.1%3A%3BC34_EXP%3D1540582116%3A%3BC39%3D1%3B8%3A00-20%3A00%3B2%3B7%3A00-22%3A00%3B3%3B7%3A00-22%3A00%3B4%3B7%3A00-22%3A00%3B5%3B7%3A00-22%3A00%3B6%3B7%3A00-22%3A00%3B7%3B7%3A00-22%3A00%3A%3BC39_EXP%3D1540498522'),
 #               75209: dict(THD_PERSIST='C4%3D589%2BLemmon%20Ave%20-%20Dallas%2C%20TX%2B%3A%3BC4_EXP%3D1572032392%3A%3BC24%3D75209%3A%3BC24_EXP%3D1572032392%3A%3BC34%3D32.1%3A%3BC34_EXP%3D1540582829%3A%3BC39%3D1%3B8%3A00-20%3A00%3B2%3B6%3A00-22%3A00%3B3%3B6%3A00-22%3A00%3B4%3B6%3A00-22%3A00%3B5%3B6%3A00-22%3A00%3B6%3B6%3A00-22%3A00%3B7%3B6%3A00-22%3A00%3A%3BC39_EXP%3D1540499992')}
-        #Pass in the random proxies from the proxy pool
-        retry_count = 5
-        while retry_count > 0:
-            try:
-                request= requests.get(url, proxies={'http':'http://'+ random.choice(gatherproxy_resp())},headers = header,
-                     params=payload, cookies = self.cookies[self.location] )
-                html = request.text
-                soup = BeautifulSoup(html, 'lxml') #html.parser
-                return soup
-            except Exception:
-                retry_count -= 1
-        request= requests.get(url, headers = header, params=payload, cookies = self.cookies[self.location])
-        html = request.text
-        soup = BeautifulSoup(html, 'lxml')
+        #Pass in the proxies from the shared proxy pool
+        html = self.get_page(url, browsestoreoption)
+        soup = BeautifulSoup(html, 'lxml') #html.parser
         return soup
+
+    # get_page() returns the raw html, for parsers that do not need a BeautifulSoup tree.
+    def get_page(self, url, browsestoreoption):
+        payload = {'browsestoreoption': browsestoreoption}
+        return self.fetch_html(url, params=payload, location=self.location)
     
     #I built this get_load_more() method to click the "load more" button in some pages and get the whole page source.
-    #Selenium will use the chrome driver to automate the click and wait procedure.
+    #Selenium will use a headless chrome driver from a shared driver_pool to automate the click and wait procedure.
     #The max_result_num is collected from the web page with "load more" button:  
     #max_result_num = [int(i.text) for i in load_more_div.find_all('span')][-1]
     def get_load_more(self, url, max_result_num, browsestoreoption):
-        driver = webdriver.Chrome('C:\\Users\\shbsc\\Downloads\\chromedriver_win32\\chromedriver.exe')  
-        # Optional argument, if not specified will search path.
         url = url + "&browsestoreoption={}".format(browsestoreoption)
-        driver.get(url)
-        driver.add_cookie(cookie_dict=cookies[self.location])
-        driver.get(url)
-
-        for i in range(math.ceil(max_result_num//24)+1):
-            try:
-                python_button  = driver.find_element_by_class_name('js-load-more-btn')
-                python_button.click()
-                time.sleep(5)
-                # time.sleep(5) # Let the user actually see something!
-            except:
-                break
-
-        soup = BeautifulSoup(driver.page_source, 'lxml')
-        driver.quit()
+        html = self.get_driver_pool().load_all(url, cookies=self.cookies[self.location],
+                                               max_clicks=math.ceil(max_result_num/self.load_more_page_size))
+        soup = BeautifulSoup(html, 'lxml')
         return soup
 
+    def get_driver_pool(self):
+        with homedepot_crawler._driver_pool_lock:
+            if homedepot_crawler.shared_driver_pool is None:
+                # Selenium is only needed on this path, so it is imported here and not when the module loads.
+                from driver_pool import driver_pool
+                homedepot_crawler.shared_driver_pool = driver_pool(self.driver_pool_size, self.chromedriver_path)
+        return homedepot_crawler.shared_driver_pool
+
     # The usage of this method is to get the brand dictionary (brand name: brand link). Notice that the stucture of-
     #- "Matresses" web page is different with others. So there will be different approach to get that information. 
+    # The brand page is fetched with browsestoreoption=2, so it does not depend on the location and is shared -
+    # -through the site_index by every crawler of the same category.
     def get_brand_dict(self):
         url = self.get_source_url()
+        if self.site_index is not None:
+            return self.site_index.get_brand_dict(url, lambda: self.crawl_brand_dict(url))
+        return self.crawl_brand_dict(url)
+
+    def crawl_brand_dict(self, url):
         soup = self.get_html(url, 2)
         if self.department == "Appliances":
-            brand_list_raw = soup.find_all('ul', attrs = {'class': 'list list--type-plain u__text-align--left '})
+            brand_list_raw = soup.find_all('ul', attrs = {'class': 'list list--type-plain u__text-align--left'})
             brand_name_ls = [i.text.strip().lower() for i in brand_list_raw[2].find_all('a')]
-            brand_link_ls = ["https://www.homedepot.com" +  (re.search(r'href="(.*?)"',str(i)).group(1)) + '&Nao={}'
+            brand_link_ls = [self.site_url +  (re.search(r'href="(.*?)"',str(i)).group(1)) + '&Nao={}'
                               for i in brand_list_raw[2].find_all('a')]
             brand_dict = dict(zip(brand_name_ls, brand_link_ls))
         #elif self.department == "bedroom-furniture":
         else:
             brand_list_raw = soup.find_all('ul', attrs={"data-refinement": "Brand"})
             brand_name_ls = [i.text.replace("\n","").split("(")[0].lower() for i in brand_list_raw[0].find_all('li')]
-            brand_link_ls = ["https://www.homedepot.com" + (re.search(r'href="(.*?)"',str(i)).group(1))  + '&Nao={}'
+            brand_link_ls = [self.site_url + (re.search(r'href="(.*?)"',str(i)).group(1))  + '&Nao={}'
                               for i in brand_list_raw[0].find_all('a')]
             brand_dict = dict(zip(brand_name_ls, brand_link_ls))
         return brand_dict
@@ -263,10 +470,11 @@ class homedepot_crawler(homedepot_site_map):
     #This is the core code to crawl product information from a target web page. I collected current prices, prices saving,-
     #- brands, product descriptions and especially product links. So, for later analytic purpose, we can crawl more product -
     #- info through product links, such as reviews, ratings, etc. 
+    #It is not timed itself: the parse_*() methods that call it are, so a bs4 parse is only counted once.
     def get_prod_info(self, soup):
         soup_p = soup.find('div', attrs={'id': "products"})
         prod_desc_raw = soup_p.find_all('a', attrs={'data-pod-type': "pr"})
-        prod_url = ["https://www.homedepot.com" + (re.search(r'href="(.*?)"',str(i)).group(1)) for i in prod_desc_raw]
+        prod_url = [self.site_url + (re.search(r'href="(.*?)"',str(i)).group(1)) for i in prod_desc_raw]
         prod_brand = [i.find('span', attrs={'class': 'pod-plp__brand-name'}).text for i in prod_desc_raw]
         prod_desc = [i.text.strip().split('\n')[-1] for i in prod_desc_raw]
 
@@ -283,6 +491,109 @@ class homedepot_crawler(homedepot_site_map):
                 price_savings.append(float(0.00))
         return price_current_2, price_savings, prod_brand, prod_desc, prod_url
     
+    # parse_prod_info() and parse_listing() run the parser selected by prod_parser on a raw listing page.
+    @timed_parse('prod_info')
+    def parse_prod_info(self, html):
+        if self.prod_parser == 'bs4':
+            return self.get_prod_info(BeautifulSoup(html, 'lxml'))
+        return prod_parser.extract_prod_info(html, self.site_url)
+
+    #Reading the total number of results from the "load more" box. If there is no "load more" button, it is None.
+    @timed_parse('load_more_listing')
+    def parse_load_more_listing(self, html):
+        if self.prod_parser == 'bs4':
+            soup = BeautifulSoup(html, 'lxml')
+            load_more_div = soup.find('div', attrs = {'id': 'load-more'})
+            max_result_num = None
+            if load_more_div is not None:
+                max_result_num = [int(i.text) for i in load_more_div.find_all('span')][-1]
+            return max_result_num, self.get_prod_info(soup)
+        return prod_parser.extract_load_more_listing(html, self.site_url)
+
+    #Crawling the page numbers from the bottom of the web page. If there is only one page, it will return an empty list.
+    @timed_parse('listing')
+    def parse_listing(self, html):
+        if self.prod_parser == 'bs4':
+            soup = BeautifulSoup(html, 'lxml')
+            page_ls = list(filter(None, [int(i.text) if i.text!='' else i.text
+                                         for i in soup.find_all('a', attrs={'class': 'hd-pagination__link'})]))
+            return page_ls, self.get_prod_info(soup)
+        return prod_parser.extract_listing(html, self.site_url)
+
+    #The page source of the browser "load more" path is already a soup, so only get_prod_info() runs on it.
+    @timed_parse('load_more_browser', parser='bs4')
+    def parse_browser_page(self, soup):
+        return self.get_prod_info(soup)
+
+    # get_page_info() fetches and parses one listing page. It returns None instead of raising so that pages -
+    # -fetched concurrently can be checked in order.
+    def get_page_info(self, url_current):
+        try:
+            html = self.get_page(url_current, 1)
+            if self.is_unchanged(url_current, html):
+                return ([], [], [], [], [])
+            return self.remember_page(url_current, html, self.parse_prod_info(html))
+        except Exception:
+            return None
+
+    # The first page is retried up to page_retries times like the other pages; None means every try failed.
+    def get_first_page(self, url_current):
+        for attempt in range(self.page_retries + 1):
+            try:
+                return self.get_page(url_current, 1)
+            except Exception:
+                continue
+        return None
+
+    # In delta mode (run_delta()), a listing page whose content hash matches the one in the price store is not -
+    # -parsed again; its products are only marked as seen. Changed pages are remembered with their product links.
+    delta_store = None
+
+    def page_key(self, url):
+        return '{}|{}'.format(self.location, url)
+
+    def is_unchanged(self, url, html):
+        if self.delta_store is None:
+            return False
+        key = self.page_key(url)
+        if self.delta_store.page_hash(key) != page_digest(html):
+            return False
+        self.unchanged_pages.append(key)
+        return True
+
+    def remember_page(self, url, html, page):
+        if self.delta_store is not None:
+            self.changed_pages[self.page_key(url)] = (page_digest(html), list(page[4]))
+        return page
+
+    # Without a page_executor the pages are fetched lazily one by one, so nothing after a failed page is requested.
+    # With one, the pages are fetched concurrently and the results still come back in page order.
+    def map_pages(self, func, urls):
+        if self.page_executor is None:
+            return map(func, urls)
+        return self.page_executor.map(func, urls)
+
+    # get_listing_url() looks up the brand link ("...&Nao={}") in the brand dictionary of the category. A crawl_plan -
+    # -(crawl_plan.py) resolves it once up front and sets listing_url, so the brand page is not fetched per store.
+    listing_url = None
+
+    def get_listing_url(self, brand_dict=None):
+        if self.listing_url is not None:
+            return self.listing_url
+        if brand_dict is None:
+            brand_dict = self.get_brand_dict()
+        if self.brand == "ge" and self.sub_department != 'Mattresses':
+            return brand_dict["ge appliances"]
+        return brand_dict[self.brand]
+
+    # make_records() turns the five lists of one page into product records (one dict per product).
+    def make_records(self, page):
+        price_current_2, price_savings, prod_brand, prod_desc, prod_url = page
+        return [{"Department": self.department, "Sub Department": self.sub_department, "Current price": price,
+                 "Price saving": saving, "Brand": brand, "Description": desc, "Product link": link,
+                 "Location": self.location, "On display": True}
+                for price, saving, brand, desc, link in zip(price_current_2, price_savings, prod_brand, prod_desc, prod_url)]
+
     #Since the "Mattresses" page has different structure with other product pages, we should deal with them seperately.
     #The main problem here is how to crawl data from multiple pages. For non-mattresses pages like "Appliances", there -
     #- might be a bar below the page indicating the location like from page 1 to page 6. For page 2 of the search, the url-
@@ -290,120 +601,209 @@ class homedepot_crawler(homedepot_site_map):
     #- through it to collect the information in each page.
     #On the other hand, for matreesses page, there can be a "load more" button below the product section if there're multiple-
     #- pages. Since this is a dynamic element, we have to use selenium to automate a series of click action to it.
-    def run(self):
-        if self.sub_department != 'Mattresses':
-            price_current_ls = [];price_savings_ls=[];prod_brand_ls = [];prod_desc_ls = [];prod_url_ls = []
-            brand_dict = self.get_brand_dict()
-            if self.brand == "ge":
-                url1 = brand_dict["ge appliances"]
-            else:
-                url1 = brand_dict[self.brand]
-            url_current = url1.replace('&Nao={}','')
-            soup = self.get_html(url_current, 1)
-            #Crawling the page numbers from the bottom of the web page. If there is only one page, it will return an empty list.
-            page_ls = list(filter(None, [int(i.text) if i.text!='' else i.text
-                                         for i in soup.find_all('a', attrs={'class': 'hd-pagination__link'})]))
+    #iter_page_info() yields the parser output (five lists) page by page, so nothing but the current page is kept in -
+    #- memory. If the first page has no products on it, nothing is yielded and self.no_items is set.
+    def iter_page_info(self):
+        self.no_items = False
+        #complete is False when a page still failed after page_retries rounds, so its products are missing; the -
+        #- urls of those pages are kept in failed_pages (and logged), so a crawl_engine can report the job.
+        self.complete = True
+        self.failed_pages = []
+        checkpoint = self.open_checkpoint()
+        if checkpoint is not None and checkpoint.plan is not None:
+            yield from self.resume(checkpoint)
+            return
+        url1 = self.get_listing_url()
+        url_current = url1.replace('&Nao={}','')
+        html = self.get_first_page(url_current)
+        if html is None:
+            #The first page still failed after page_retries retries: the job is left incomplete (and unstarted in -
+            #- its checkpoint) instead of failing the other jobs of a crawl_engine run.
+            self.page_failed(url_current)
+            return
+        try:
+            ls, max_result_num, page = self.parse_first_page(html)
+        except Exception:
+            self.no_items = True
+            if checkpoint is not None:
+                checkpoint.finish(no_items=True)
+            return
+        shown = len(page[0])
+        page = ([], [], [], [], []) if self.is_unchanged(url_current, html) else self.remember_page(url_current, html, page)
+        if self.sub_department == 'Mattresses' and self.load_more_source == 'browser' and ls:
+            #The browser shows the first page again, so only the products after it are new. This path has no -
+            #- pages to checkpoint, so it is always crawled from the start.
+            yield page
+            soup = self.get_load_more(url_current, max_result_num, 1)
             try:
-                price_current_2, price_savings, prod_brand, prod_desc, prod_url = self.get_prod_info(soup)
-                price_current_ls.extend(price_current_2)
-                price_savings_ls.extend(price_savings)
-                prod_brand_ls.extend(prod_brand)
-                prod_desc_ls.extend(prod_desc)
-                prod_url_ls.extend(prod_url)
-            except:
-                df_dict = {"Department": [self.department], "Sub Department": [self.sub_department], "Current price": [0.00],
-                          "Price saving": [0.00], "Brand":[ "No items on display"], "Description":[ "No items on display"], 
-                           "Product link": ["No items on display"], "Location": [self.location]}
-                result_df = pd.DataFrame(df_dict)
-                return result_df
-            # If there is only one page, we just store the result to a dataframe.
-            if page_ls == []:
-                Department_ls = [self.department]* len(price_current_ls)
-                Sub_department_ls = [self.sub_department]* len(price_current_ls)
-                location_ls = [self.location] * len(price_current_ls)
-                df_dict = {"Department": Department_ls, "Sub Department": Sub_department_ls, "Current price":price_current_ls,
-                          "Price saving": price_savings_ls, "Brand": prod_brand_ls, "Description": prod_desc_ls, "Product link":
-                          prod_url_ls, "Location": location_ls}
-                result_df = pd.DataFrame(df_dict)
+                page = self.parse_browser_page(soup)
+            except Exception:
+                self.page_failed(url_current)
+                return
+            yield tuple(column[shown:] for column in page)
+            return
+        urls = [url1.format(i) for i in ls]
+        if checkpoint is not None:
+            checkpoint.start([url_current] + urls)
+            checkpoint.add_page(url_current, page)
+        yield page
+        yield from self.iter_listing_pages(urls, checkpoint)
+        if checkpoint is not None:
+            checkpoint.finish()
+
+    # parse_first_page() parses the first listing page and returns the "Nao" offsets of the other pages, the total -
+    # -number of results of a "load more" page (None otherwise) and the products of the page itself.
+    def parse_first_page(self, html):
+        if self.sub_department != 'Mattresses':
+            page_ls, page = self.parse_listing(html)
             # If there are multiple pages, we need to loop through a list to pass in "Nao ={}" parameter to the url.
-            else:
-                ls = list(range(24, (max(page_ls)+2)*12,12)) 
-                for i in ls:
-                    try:
-                        url_current = url1.format(i)
-                        soup = self.get_html(url_current, 1)
-                        price_current_2, price_savings, prod_brand, prod_desc, prod_url = self.get_prod_info(soup)
-                        price_current_ls.extend(price_current_2)
-                        price_savings_ls.extend(price_savings)
-                        prod_brand_ls.extend(prod_brand)
-                        prod_desc_ls.extend(prod_desc)
-                        prod_url_ls.extend(prod_url)
-                    except:
-                        break
-        # The structure is different for Mattresses page.
-        elif self.sub_department == 'Mattresses':
-            price_current_ls = [];price_savings_ls=[];prod_brand_ls = [];prod_desc_ls = [];prod_url_ls = []
-            brand_dict = self.get_brand_dict()
-            url1 = brand_dict[self.brand]
-            url_current = url1.replace('&Nao={}','')
-            soup = self.get_html(url_current, 1)
-            #Find the "load more" button in the page.
-            load_more_div = soup.find('div', attrs = {'id': 'load-more'})
-            try:
-                price_current_2, price_savings, prod_brand, prod_desc, prod_url = self.get_prod_info(soup)
-                price_current_ls.extend(price_current_2)
-                price_savings_ls.extend(price_savings)
-                prod_brand_ls.extend(prod_brand)
-                prod_desc_ls.extend(prod_desc)
-                prod_url_ls.extend(prod_url)
-            except:
-                df_dict = {"Department": [self.department], "Sub Department": [self.sub_department], "Current price": [0.00],
-                          "Price saving": [0.00], "Brand":[ "No items on display"], "Description":[ "No items on display"], 
-                           "Product link": ["No items on display"], "Location": [self.location]}
-                result_df = pd.DataFrame(df_dict)
-                return result_df
-            #If there is no "load more" button in the page, we can store the result directly to the result_df dataframe.
-            if load_more_div == []:
-                Department_ls = [self.department]* len(price_current_ls)
-                Sub_department_ls = [self.sub_department]* len(price_current_ls)
-                location_ls = [self.location] * len(price_current_ls)
-                df_dict = {"Department": Department_ls, "Sub Department": Sub_department_ls, "Current price":price_current_ls,
-                          "Price saving": price_savings_ls, "Brand": prod_brand_ls, "Description": prod_desc_ls, "Product link":
-                          prod_url_ls, "Location": location_ls}
-                result_df = pd.DataFrame(df_dict)
-            #If there is a "load more" button, we can just call the get_load_more() method to get the source page.
-            else:
-                max_result_num = [int(i.text) for i in load_more_div.find_all('span')][-1]
-                
-                soup = get_load_more(self, url_current, max_result_num, 1)
-                price_current_ls = [];price_savings_ls=[];prod_brand_ls = [];prod_desc_ls = [];prod_url_ls = []
-                try:
-                    price_current_2, price_savings, prod_brand, prod_desc, prod_url = self.get_prod_info(soup)
-                    price_current_ls.extend(price_current_2)
-                    price_savings_ls.extend(price_savings)
-                    prod_brand_ls.extend(prod_brand)
-                    prod_desc_ls.extend(prod_desc)
-                    prod_url_ls.extend(prod_url)
-                    
-                except:
-                    df_dict = {"Department": [self.department], "Sub Department": [self.sub_department], "Current price": [0.00],
-                          "Price saving": [0.00], "Brand":[ "No items on display"], "Description":[ "No items on display"], 
-                           "Product link": ["No items on display"], "Location": [self.location]}
-                    result_df = pd.DataFrame(df_dict)
-                    return result_df
-                
-                
-        Department_ls = [self.department]* len(price_current_ls)
-        Sub_department_ls = [self.sub_department]* len(price_current_ls)
-        location_ls = [self.location] * len(price_current_ls)
-        df_dict = {"Department": Department_ls, "Sub Department": Sub_department_ls, "Current price":price_current_ls,
-                  "Price saving": price_savings_ls, "Brand": prod_brand_ls, "Description": prod_desc_ls, "Product link":
-                  prod_url_ls, "Location": location_ls}
-        result_df = pd.DataFrame(df_dict)
-                
-        
+            return prod_parser.listing_offsets(page_ls), None, page
+        # The structure is different for Mattresses page. The "load more" button shows load_more_page_size more -
+        # -products per click, which are the same products the "Nao" parameter pages through, so by default the -
+        # -extra pages are fetched over http like above. If there is no "load more" button, there is one page.
+        max_result_num, page = self.parse_load_more_listing(html)
+        return prod_parser.load_more_offsets(max_result_num, self.load_more_page_size), max_result_num, page
+
+    # iter_listing_pages() yields the pages of urls in order. Pages that failed are requeued and tried again after -
+    # -the others, up to page_retries more rounds; only then is the job marked incomplete.
+    def iter_listing_pages(self, urls, checkpoint=None):
+        pending = urls
+        for attempt in range(self.page_retries + 1):
+            failed = []
+            for url, page in zip(pending, self.map_pages(self.get_page_info, pending)):
+                if page is None:
+                    failed.append(url)
+                    continue
+                if checkpoint is not None:
+                    checkpoint.add_page(url, page)
+                yield page
+            if not failed:
+                return
+            pending = failed
+        for url in pending:
+            self.page_failed(url)
+
+    def page_failed(self, url):
+        self.complete = False
+        self.failed_pages.append(url)
+        logger.warning('%s|%s|%s|%s: giving up on %s after %d retries', self.department, self.sub_department,
+                       self.brand, self.location, url, self.page_retries)
+
+    def open_checkpoint(self):
+        if self.checkpoint_dir is None:
+            return None
+        job = (self.department, self.sub_department, self.brand, self.location)
+        return job_checkpoint(checkpoint_path(self.checkpoint_dir, job))
+
+    # Only a job without failed pages should drop its checkpoint, so a later run still retries the missing pages.
+    def clear_checkpoint(self):
+        if self.checkpoint_dir is not None:
+            job = (self.department, self.sub_department, self.brand, self.location)
+            path = checkpoint_path(self.checkpoint_dir, job)
+            if os.path.exists(path):
+                os.remove(path)
+
+    # resume() yields the pages a checkpoint already has, then crawls the missing ones. In delta mode the skipped -
+    # -pages of the interrupted run are not known any more, so removals are not reported for a resumed job.
+    def resume(self, checkpoint):
+        if self.delta_store is not None:
+            self.complete = False
+        for url in checkpoint.plan:
+            #Pages are handed out once and dropped, so the loaded checkpoint does not stay in memory.
+            if url in checkpoint.pages:
+                yield checkpoint.pages.pop(url)
+        missing = checkpoint.missing()
+        if checkpoint.finished and not missing:
+            self.no_items = checkpoint.no_items
+            return
+        yield from self.iter_listing_pages(missing, checkpoint)
+        checkpoint.finish()
+
+    # iter_pages() yields the product records (dicts) page by page.
+    def iter_pages(self):
+        for page in self.iter_page_info():
+            yield self.make_records(page)
+
+    def iter_records(self):
+        '''Yield the product records of this job one at a time.'''
+        for records in self.iter_pages():
+            yield from records
+
+    # If nothing is on display in the location, the result has a single row with "On display" False and no product data.
+    def no_items_records(self):
+        return [{"Department": self.department, "Sub Department": self.sub_department, "Current price": None,
+                 "Price saving": None, "Brand": None, "Description": None, "Product link": None,
+                 "Location": self.location, "On display": False}]
+
+    # iter_result_pages() is iter_pages() plus the "nothing on display" row, i.e. exactly the rows of run().
+    def iter_result_pages(self):
+        yield from self.iter_pages()
+        if self.no_items:
+            yield self.no_items_records()
+
+    # With a profile_dir, run() is profiled with cProfile and the stats go to one .prof file per job.
+    profile_dir = None
+
+    def run(self):
+        if self.profile_dir is None:
+            return self.collect_result()
+        job = '_'.join(str(i) for i in (self.department, self.sub_department, self.brand, self.location))
+        with profiled(os.path.join(self.profile_dir, re.sub(r'\W+', '_', job) + '.prof')):
+            return self.collect_result()
+
+    # collect_result() collects the parser's column lists page by page and builds the typed dataframe from them directly.
+    def collect_result(self):
+        price_current_ls = [];price_savings_ls=[];prod_brand_ls = [];prod_desc_ls = [];prod_url_ls = []
+        for price_current_2, price_savings, prod_brand, prod_desc, prod_url in self.iter_page_info():
+            price_current_ls.extend(price_current_2)
+            price_savings_ls.extend(price_savings)
+            prod_brand_ls.extend(prod_brand)
+            prod_desc_ls.extend(prod_desc)
+            prod_url_ls.extend(prod_url)
+        if self.no_items:
+            return result_schema.empty_result(self.department, self.sub_department, self.location)
+        result_df = result_schema.build_result_df(self.department, self.sub_department, self.location,
+                                                  price_current_ls, price_savings_ls, prod_brand_ls, prod_desc_ls,
+                                                  prod_url_ls)
         return result_df
 
+    # run_delta() crawls the job against a price_store (price_store.py) and returns only what changed since the -
+    # -last crawl: one row per new, removed or re-priced product, with a "Change" and a "Previous price" column.
+    def run_delta(self, store):
+        self.delta_store = store
+        self.changed_pages = {}
+        self.unchanged_pages = []
+        seen_at = time.time()
+        try:
+            records = [record for page in self.iter_pages() for record in page]
+        finally:
+            self.delta_store = None
+        job_key = '|'.join(str(i) for i in (self.department, self.sub_department, self.brand, self.location))
+        changes = store.apply(job_key, self.location, records, self.changed_pages, self.unchanged_pages,
+                              seen_at=seen_at, complete=self.complete)
+        return pd.DataFrame(changes, columns=self.columns + ["Change", "Previous price"])
+
+    # run_page() is the stateless unit of work of a crawl_frontier (frontier.py): it fetches and parses one listing -
+    # -page and returns its records. The first page (offset 0) also returns the "Nao" offsets of the other pages, -
+    # -or the "nothing on display" row if it has no products. Errors are raised, so the frontier can retry the page.
+    def run_page(self, offset=0):
+        url1 = self.get_listing_url()
+        if offset:
+            html = self.get_page(url1.format(offset), 1)
+            return self.make_records(self.parse_prod_info(html)), []
+        html = self.get_page(url1.replace('&Nao={}',''), 1)
+        try:
+            ls, max_result_num, page = self.parse_first_page(html)
+        except Exception:
+            return self.no_items_records(), []
+        return self.make_records(page), ls
+
+    # enqueue() is the producer side of run() for a crawl_frontier: only the first page is added, the workers add -
+    # -the other pages once they have read it.
+    def enqueue(self, frontier):
+        job = (self.department, self.sub_department, self.brand, self.location)
+        return frontier.add_jobs([(job, self.get_listing_url())])
+
 
 
 if __name__ == "__main__":
@@ -416,40 +816,50 @@ if __name__ == "__main__":
     except FakeUserAgentError:
         pass
 
+    #Keep the search engine and the brand dictionaries on disk, so later runs load them instead of crawling again.
+    homedepot_site_map.site_index = site_index('site_index.json')
+
     #Create the search engine (dictionary) for department and sub_department first.
     d = homedepot_site_map()
     dep_dict = d.run()
     # [In]: dep_dict["Furniture"]["Bedroom Furniture"]["Mattresses"]
     # [Out]: 'https://www.homedepot.com/b/Furniture-Bedroom-Furniture-Mattresses/N-5yc1vZc7oe'
     
-    #Create instances for specific department, sub_department, brands, and location.
-    s1 = homedepot_crawler('Appliances', 'Dishwashers', 'LG',10022)
-    s2 = homedepot_crawler('Appliances', 'Dishwashers', 'LG',75209)
-    s3 = homedepot_crawler('Appliances', 'Dishwashers', 'Samsung',10022)
-    s4 = homedepot_crawler('Appliances', 'Dishwashers', 'Samsung',75209)
-    s5 = homedepot_crawler('Appliances', 'Refrigerators', 'Whirlpool',10022)
-    s6 = homedepot_crawler('Appliances', 'Refrigerators', 'Whirlpool',75209)
-    s7 = homedepot_crawler('Appliances', 'Refrigerators', 'GE',10022)
-    s8 = homedepot_crawler('Appliances', 'Refrigerators', 'GE',75209)
-    s9 = homedepot_crawler('Bedroom Furniture', 'Mattresses', 'Sealy',10022)
-    s10 = homedepot_crawler('Bedroom Furniture', 'Mattresses', 'Sealy',75209)
+    #Load the jobs for specific department, sub_department, brands, and location from the crawl matrix.
+    #The engine plans them first, so each brand page is fetched once and only the listings are fetched per store.
+    from crawl_plan import load_matrix
+    jobs = load_matrix("crawl_matrix.yaml")
     
-    #Get the result dataframe by calling the run() method.
-    result_1 = s1.run()
-    result_2 = s2.run()
-    result_3 = s3.run()
-    result_4 = s4.run()
-    result_5 = s5.run()
-    result_6 = s6.run()
-    result_7 = s7.run()
-    result_8 = s8.run()
-    result_9 = s9.run()
-    result_10 = s10.run()
+    #Run the jobs concurrently. engine.run(jobs) would return the concatenated dataframe of every job's run().
+    from crawl_engine import crawl_engine
+    engine = crawl_engine(dep_dict, max_concurrency=8, per_host=4,
+                          crawler_class=homedepot_crawler, site_map_class=homedepot_site_map)
     
-    #Concatenate the dataframes into one dataframe.
-    result_df = pd.concat([result_1, result_2, result_3, result_4, result_5, result_6, result_7, result_8, result_9, result_10], 
-                      axis =0, ignore_index= True)
+    #Time every request, proxy try and parse, and write the numbers next to the result when the crawl is done.
+    from metrics import crawl_metrics
+    homedepot_site_map.metrics = crawl_metrics()
     
-    #Save the result to the working directory.
-    result_df.to_csv("result_df.csv", index=False)
-
+    #Checkpoint every page, so rerunning the script after a crash resumes the crawl instead of starting over.
+    homedepot_crawler.checkpoint_dir = "checkpoints"
+    
+    #Stream the result to the working directory batch by batch, so a crash late in the crawl keeps what was written.
+    from record_sink import csv_sink
+    with csv_sink("result_df.csv", columns=homedepot_crawler.columns, frame_builder=result_schema.records_to_frame) as sink:
+        engine.stream(jobs, sink)
+    
+    #Fetch every product's detail page once (a product listed in both stores is fetched once) and keep the ratings, -
+    #- review counts, model/SKU and availability next to the result; join_details() adds them to result_df by link.
+    from enrichment import detail_enricher
+    product_links = pd.read_csv("result_df.csv", usecols=["Product link"])["Product link"]
+    with csv_sink("product_details.csv", columns=result_schema.DETAIL_COLUMNS,
+                  frame_builder=result_schema.details_to_frame) as sink:
+        detail_enricher(d, max_concurrency=16, host_limiter=engine.limiter).stream(product_links, sink)
+    
+    homedepot_site_map.metrics.write("metrics.json")
+    homedepot_site_map.metrics.write("metrics.prom")
+    
+    #Jobs that finished completely drop their checkpoints; the others keep them, so rerunning the script only -
+    #- crawls their missing pages.
+    engine.clear_checkpoints()
+    if engine.incomplete:
+        print("{} job(s) are missing pages, rerun to retry them: {}".format(len(engine.incomplete), list(engine.incomplete)))
@@ -0,0 +1,229 @@
+# coding: utf-8
+#!/usr/bin/env python
+"""Offline benchmark suite for the homedepot crawler.
+
+Starts the local stand-in site (stand_in_site.py) with the saved fixtures and measures get_dep_dict(),
+get_brand_dict(), get_prod_info() (both parsers, no network) and full run() latency, plus crawl_engine
+throughput over a job list (threaded, and through the fetch/parse pipeline with a process-pool parser) and
+detail_enricher throughput over the product links it found. Results are written as JSON, and a previous result file can be passed in with
+--baseline to print the change per benchmark and fail on regressions.
+
+    python benchmarks/run_benchmarks.py --rounds 20 --latency 0.02 --output bench.json
+    python benchmarks/run_benchmarks.py --baseline bench.json --fail-above 1.25
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+from bs4 import BeautifulSoup
+
+import prod_parser
+from crawl_engine import crawl_engine
+from enrichment import detail_enricher
+from fetch_policy import fetch_policy
+from pipeline import fetch_parse_pipeline
+from Homedepot_Crawler_Final_Siyao_Chen import homedepot_crawler, homedepot_site_map
+from stand_in_site import FIXTURES, load_fixture, stand_in_site
+
+
+def summarize(samples, units=1):
+    '''Latency stats in milliseconds for a list of durations in seconds; units is the work done per sample.'''
+    ordered = sorted(samples)
+    total = sum(samples)
+    return {
+        'n': len(samples),
+        'mean_ms': 1000 * statistics.mean(samples),
+        'p50_ms': 1000 * ordered[len(ordered) // 2],
+        'p95_ms': 1000 * ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))],
+        'min_ms': 1000 * ordered[0],
+        'max_ms': 1000 * ordered[-1],
+        'per_second': units * len(samples) / total if total else None,
+    }
+
+
+def timed(func, rounds):
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=HERE, stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+# The lxml extractors must return exactly what the bs4 get_prod_info() path does, so every listing fixture is parsed -
+# -both ways before anything is timed; a difference fails the run.
+def check_parser_parity():
+    crawler = homedepot_crawler('Appliances', 'Dishwashers', 'LG', 10022, dep_dict={})
+    checked = []
+    for name in sorted(os.listdir(FIXTURES)):
+        html = load_fixture(name)
+        if 'id="products"' not in html:
+            continue
+        bs4_info = crawler.get_prod_info(BeautifulSoup(html, 'lxml'))
+        assert prod_parser.extract_prod_info(html, crawler.site_url) == bs4_info, name
+        for method in ('parse_listing', 'parse_load_more_listing'):
+            results = []
+            for parser in ('bs4', 'lxml'):
+                crawler.prod_parser = parser
+                results.append(getattr(crawler, method)(html))
+            assert results[0] == results[1], '{} ({})'.format(name, method)
+        checked.append(name)
+    return checked
+
+
+def bench_parsers(rounds):
+    results = {}
+    for name in ['dishwashers_lg_p1.html', 'mattresses_sealy_p1.html']:
+        html = load_fixture(name)
+        crawler = homedepot_crawler('Appliances', 'Dishwashers', 'LG', 10022, dep_dict={})
+        key = name.split('.')[0]
+        results['get_prod_info[bs4,{}]'.format(key)] = summarize(
+            timed(lambda: crawler.get_prod_info(BeautifulSoup(html, 'lxml')), rounds))
+        results['get_prod_info[lxml,{}]'.format(key)] = summarize(
+            timed(lambda: prod_parser.extract_prod_info(html), rounds))
+    return results
+
+
+# Brands with a listing on the stand-in site; every job of the engine benchmark is a distinct listing crawl, so the -
+# -planner has nothing to merge and the rates count real work.
+DISHWASHER_BRANDS = ['LG', 'Samsung', 'Whirlpool', 'GE Appliances', 'Bosch', 'KitchenAid', 'Frigidaire']
+MATTRESS_BRANDS = ['Sealy', 'Serta', 'Zinus', 'Simmons']
+
+
+def bench_site(site, rounds, concurrency, brands_per_category):
+    results = {}
+    site_map = homedepot_site_map()
+    results['get_dep_dict'] = summarize(timed(lambda: site_map.get_dep_dict(site_map.url), rounds))
+    dep_dict = site_map.run()
+
+    crawler = homedepot_crawler('Appliances', 'Dishwashers', 'LG', 10022, dep_dict=dep_dict)
+    results['get_brand_dict'] = summarize(timed(crawler.get_brand_dict, rounds))
+
+    for job in [('Appliances', 'Dishwashers', 'LG', 10022), ('Bedroom Furniture', 'Mattresses', 'Sealy', 75209)]:
+        crawler = homedepot_crawler(*job, dep_dict=dep_dict)
+        rows = len(crawler.run())
+        results['run[{}]'.format(job[1])] = dict(summarize(timed(crawler.run, rounds), rows), rows=rows)
+
+    jobs = [('Appliances', 'Dishwashers', brand, location)
+            for brand in DISHWASHER_BRANDS[:brands_per_category] for location in (10022, 75209)]
+    jobs += [('Bedroom Furniture', 'Mattresses', brand, location)
+             for brand in MATTRESS_BRANDS[:brands_per_category] for location in (10022, 75209)]
+    engine = crawl_engine(dep_dict, max_concurrency=concurrency, per_host=concurrency)
+    before = site.requests
+    start = time.perf_counter()
+    result_df = engine.run(jobs)
+    rows = len(result_df)
+    elapsed = time.perf_counter() - start
+    crawls = len(engine.last_plan.listings)
+    results['crawl_engine'] = {'jobs': len(jobs), 'listing_crawls': crawls, 'concurrency': concurrency,
+                               'rows': rows, 'requests': site.requests - before, 'seconds': elapsed,
+                               'jobs_per_second': crawls / elapsed, 'rows_per_second': rows / elapsed}
+
+    # The pipeline's time includes starting its parse processes, which only pays off on larger crawls.
+    pipeline = fetch_parse_pipeline(crawl_engine(dep_dict, max_concurrency=concurrency, per_host=concurrency),
+                                    fetch_workers=concurrency)
+    before = site.requests
+    start = time.perf_counter()
+    pipeline_rows = len(pipeline.run(jobs))
+    elapsed = time.perf_counter() - start
+    results['fetch_parse_pipeline'] = {'jobs': len(jobs), 'listing_crawls': len(pipeline.engine.last_plan.listings),
+                                       'parse_workers': pipeline.parse_workers,
+                                       'rows': pipeline_rows, 'requests': site.requests - before,
+                                       'seconds': elapsed, 'rows_per_second': pipeline_rows / elapsed}
+
+    enricher = detail_enricher(max_concurrency=concurrency, host_limiter=engine.limiter)
+    before = site.requests
+    start = time.perf_counter()
+    details = len(enricher.run(result_df['Product link']))
+    elapsed = time.perf_counter() - start
+    results['detail_enricher'] = {'rows': rows, 'details': details, 'requests': site.requests - before,
+                                  'seconds': elapsed, 'details_per_second': details / elapsed}
+    return results
+
+
+# Every benchmark with a mean latency is compared with the baseline; ratio > 1 means slower than before.
+def compare(results, baseline_path, fail_above):
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)['results']
+    failed = []
+    for name, stats in sorted(results.items()):
+        old = baseline.get(name)
+        if not old:
+            continue
+        if 'mean_ms' in stats and 'mean_ms' in old:
+            ratio = stats['mean_ms'] / old['mean_ms']
+        elif 'seconds' in stats and 'seconds' in old:
+            ratio = stats['seconds'] / old['seconds']
+        else:
+            continue
+        print('{:45s} {:8.3f}x'.format(name, ratio))
+        if fail_above is not None and ratio > fail_above:
+            failed.append(name)
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.0, help='mean added latency per request, seconds')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='share of requests answered with 503')
+    parser.add_argument('--blocked-rate', type=float, default=0.0, help='share answered with a captcha page')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='share answered with 429')
+    parser.add_argument('--rate', type=float, default=None,
+                        help='starting requests per second per host of the fetch policy (default: no rate limit)')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--brands-per-category', type=int, default=4,
+                        help='engine jobs: this many dishwasher and mattress brands, each in two stores')
+    parser.add_argument('--output', default=None, help='write the JSON results to this file')
+    parser.add_argument('--baseline', default=None, help='compare with an earlier JSON result file')
+    parser.add_argument('--fail-above', type=float, default=None, help='exit 1 if a benchmark is this many times slower')
+    args = parser.parse_args(argv)
+
+    parity = check_parser_parity()
+    results = bench_parsers(args.rounds)
+    with stand_in_site(latency=args.latency, failure_rate=args.failure_rate, blocked_rate=args.blocked_rate,
+                       throttle_rate=args.throttle_rate) as site:
+        homedepot_site_map.site_url = site.url
+        homedepot_site_map.proxy_list_url = site.url + '/proxylist'
+        # Short backoff, and no rate limit unless --rate is given, so the numbers measure the crawler itself.
+        homedepot_site_map.shared_fetch_policy = fetch_policy(rate=args.rate, base_delay=0.01, max_delay=0.5)
+        results.update(bench_site(site, args.rounds, args.concurrency, args.brands_per_category))
+
+    report = {
+        'meta': {'timestamp': time.time(), 'commit': git_commit(), 'python': platform.python_version(),
+                 'platform': platform.platform(), 'args': vars(args), 'parser_parity': parity},
+        'results': results,
+    }
+    payload = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(payload + '\n')
+    else:
+        print(payload)
+    if args.baseline:
+        failed = compare(results, args.baseline, args.fail_above)
+        if failed:
+            print('regressed: ' + ', '.join(failed))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
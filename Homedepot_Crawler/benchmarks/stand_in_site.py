@@ -0,0 +1,158 @@
+# coding: utf-8
+#!/usr/bin/env python
+"""Provides a local stand-in for homedepot.com that serves the saved html fixtures.
+
+The stand_in_site class runs a threaded HTTP server on localhost with the site map, the Bedroom Furniture page,
+the Dishwashers and Mattresses category (brand) pages, a multi-page "Nao" listing (LG dishwashers) and a
+"load more" listing (Sealy mattresses), each also served for the other brands of its category, plus a product
+detail page for every /p/ link. It can add latency and fail a share of the requests, so the crawler's
+retry path can be measured too, and answer a share with a captcha page (HTTP 200) or a 429 to exercise the
+fetch policy's block detection and backoff. Point the crawler at it with homedepot_site_map.site_url = site.url.
+"""
+
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# path -> fixture, or path -> (fixtures, Nao step) for listings. Without "Nao" the first fixture is served; the -
+# -following ones are served for Nao=24, 24+step, ... (wrapping around past the last one).
+ROUTES = {
+    '/c/site_map': 'site_map.html',
+    '/b/Furniture-Bedroom-Furniture/N-5yc1vZc7oa': 'bedroom_furniture.html',
+    '/b/Appliances-Dishwashers/N-5yc1vZc3po': 'dishwashers.html',
+    '/b/Furniture-Bedroom-Furniture-Mattresses/N-5yc1vZc7oe': 'mattresses.html',
+    '/b/Appliances-Dishwashers/LG/N-5yc1vZc3poZ1z0v9v':
+        (['dishwashers_lg_p1.html', 'dishwashers_lg_p2.html', 'dishwashers_lg_p3.html'], 12),
+    '/b/Furniture-Bedroom-Furniture-Mattresses/Sealy/N-5yc1vZc7oeZ1z0tqn':
+        (['mattresses_sealy_p1.html', 'mattresses_sealy_p2.html', 'mattresses_sealy_p3.html'], 24),
+    # An empty proxy list, so the proxy pool never reaches out to gatherproxy.com during a benchmark.
+    '/proxylist': None,
+}
+# Every other brand listing of a category is served from the category's listing fixtures, so a benchmark can run -
+# -many distinct brand jobs.
+LISTING_PREFIXES = {
+    '/b/Appliances-Dishwashers/': ROUTES['/b/Appliances-Dishwashers/LG/N-5yc1vZc3poZ1z0v9v'],
+    '/b/Furniture-Bedroom-Furniture-Mattresses/':
+        ROUTES['/b/Furniture-Bedroom-Furniture-Mattresses/Sealy/N-5yc1vZc7oeZ1z0tqn'],
+}
+# Every product page (/p/<name>/<id>) is served from one template, with __ID__ set to the id in the path.
+PRODUCT_PREFIX = '/p/'
+PRODUCT_FIXTURE = 'product_detail.html'
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES, name), 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def pick_fixture(route, query):
+    if not isinstance(route, tuple):
+        return route
+    fixtures, step = route
+    nao = parse_qs(query).get('Nao')
+    if not nao:
+        return fixtures[0]
+    return fixtures[1 + (int(nao[0]) - 24) // step % (len(fixtures) - 1)]
+
+
+class stand_in_handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; without this, delayed ACKs add ~40ms to every keep-alive request.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body, headers=None):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        site = self.server.site
+        site.count_request()
+        if site.latency:
+            time.sleep(random.uniform(0, 2 * site.latency))
+        if site.failure_rate and random.random() < site.failure_rate:
+            self.send_body(503, '<html><body>Service Unavailable</body></html>')
+            return
+        if site.blocked_rate and random.random() < site.blocked_rate:
+            self.send_body(200, '<html><head><title>Access Denied</title></head><body>Please solve the captcha '
+                                'to continue.</body></html>')
+            return
+        if site.throttle_rate and random.random() < site.throttle_rate:
+            self.send_body(429, '<html><body>Too Many Requests</body></html>', {'Retry-After': '0'})
+            return
+        parts = urlsplit(self.path)
+        if parts.path.startswith(PRODUCT_PREFIX):
+            product_id = parts.path.rstrip('/').rsplit('/', 1)[-1]
+            self.send_body(200, site.fixture(PRODUCT_FIXTURE).replace('__ID__', product_id))
+            return
+        route = ROUTES.get(parts.path)
+        if route is None and parts.path not in ROUTES:
+            route = next((r for prefix, r in LISTING_PREFIXES.items() if parts.path.startswith(prefix)), None)
+            if route is None:
+                self.send_body(404, '<html><body>Not Found</body></html>')
+                return
+        name = pick_fixture(route, parts.query)
+        body = site.fixture(name) if name else ''
+        self.send_body(200, body)
+
+
+# latency is the mean added delay in seconds (uniform between 0 and twice the mean), failure_rate the share of -
+# -requests answered with HTTP 503, blocked_rate the share answered with a captcha page and throttle_rate with a 429.
+# An example usage is like this:
+# [In]: with stand_in_site(latency=0.05) as site:
+# [In]:     homedepot_site_map.site_url = site.url
+class stand_in_site:
+
+    def __init__(self, port=0, latency=0.0, failure_rate=0.0, blocked_rate=0.0, throttle_rate=0.0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.blocked_rate = blocked_rate
+        self.throttle_rate = throttle_rate
+        self.requests = 0
+        self._fixtures = {}
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), stand_in_handler)
+        self.server.daemon_threads = True
+        self.server.site = self
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+        self.thread = None
+
+    # Links in the fixtures are written as __SITE__/..., so they point back at this server.
+    def fixture(self, name):
+        if name not in self._fixtures:
+            self._fixtures[name] = load_fixture(name).replace('__SITE__', self.url)
+        return self._fixtures[name]
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
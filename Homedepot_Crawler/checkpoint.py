@@ -0,0 +1,89 @@
+# coding: utf-8
+#!/usr/bin/env python
+"""Provides durable per-job checkpoints for long multi-page crawls.
+
+A job_checkpoint is an append-only JSON-lines file: the page plan of the job (every listing page url), then one
+line per finished page with its parsed product lists, and a final line once the job is done. Every line is
+fsynced, so after a crash or a kill a restarted run reads the file back, yields the pages it already has and only
+crawls the pages that are missing, including pages that failed before.
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+
+def checkpoint_path(directory, job):
+    '''The checkpoint file of a (department, sub_department, brand, location) job.'''
+    key = '|'.join(str(i) for i in job)
+    name = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16] + '.jsonl'
+    return os.path.join(directory, name)
+
+
+# A checkpoint belongs to one run: point homedepot_crawler.checkpoint_dir at a fresh directory for a new run and -
+# -at the same directory to resume it. An example usage is like this:
+# [In]: homedepot_crawler.checkpoint_dir = 'checkpoints/2018-10-25'
+# [In]: result_df = homedepot_crawler('Appliances', 'Dishwashers', 'LG', 10022).run()   # resumes if interrupted
+class job_checkpoint:
+
+    def __init__(self, path):
+        self.path = path
+        self.plan = None
+        # done holds the url of every finished page; pages holds the parsed lists, but only those read back by load().
+        self.done = set()
+        self.pages = {}
+        self.finished = False
+        self.no_items = False
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            self.load()
+
+    # A line cut short by a crash is ignored; the page it belonged to is simply crawled again.
+    def load(self):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if 'plan' in entry:
+                    self.plan = entry['plan']
+                elif 'page' in entry:
+                    self.done.add(entry['url'])
+                    self.pages[entry['url']] = tuple(entry['page'])
+                elif 'finished' in entry:
+                    self.finished = True
+                    self.no_items = entry['no_items']
+
+    def _append(self, entry):
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+    def start(self, plan):
+        self.plan = list(plan)
+        self._append({'plan': self.plan})
+
+    # The page is only written to the file, so a fresh crawl keeps no more than the current page in memory.
+    def add_page(self, url, page):
+        self.done.add(url)
+        self._append({'url': url, 'page': [list(column) for column in page]})
+
+    def missing(self):
+        '''The planned pages that are not done yet, in page order.'''
+        return [url for url in self.plan or [] if url not in self.done]
+
+    def finish(self, no_items=False):
+        if self.plan is None:
+            self.start([])
+        self.finished = True
+        self.no_items = no_items
+        self._append({'finished': True, 'no_items': no_items})
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,174 @@
+# coding: utf-8
+#!/usr/bin/env python
+"""Provides a concurrent crawl engine for many homedepot_crawler jobs.
+
+The crawl_engine class takes a list of (department, sub_department, brand, location) jobs, runs them on a thread
+pool and fetches their "Nao" pages concurrently. The number of requests in flight is capped by a global limit and
+a per-host limit, so throughput scales with the concurrency setting instead of the number of jobs. The jobs go
+through a crawl_plan (crawl_plan.py) first, so every brand page is fetched once and repeated jobs are crawled once.
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import result_schema
+from crawl_plan import crawl_plan
+
+
+logger = logging.getLogger('homedepot_crawler.engine')
+
+
+# The fetch_limiter caps concurrent requests with one global semaphore and one semaphore per host.
+# homedepot_site_map.fetch_html() holds a slot for each try of a request only, not for the backoff between tries.
+class fetch_limiter:
+
+    def __init__(self, max_concurrency=8, per_host=4):
+        self.max_concurrency = max_concurrency
+        self.per_host = per_host
+        self._global = threading.BoundedSemaphore(max_concurrency)
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _host_semaphore(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = threading.BoundedSemaphore(self.per_host)
+            return self._hosts[host]
+
+    @contextmanager
+    def slot(self, url):
+        host = self._host_semaphore(url)
+        with host, self._global:
+            yield
+
+
+# crawl_incomplete is raised by a strict engine once every job has run, if some jobs still miss pages; incomplete -
+# -maps each such job to the urls of its failed pages and result is what run() would have returned.
+class crawl_incomplete(IOError):
+
+    def __init__(self, incomplete, result=None):
+        super().__init__('{} job(s) are missing pages after every retry: {}'.format(len(incomplete), list(incomplete)))
+        self.incomplete = incomplete
+        self.result = result
+
+
+# An example usage of the engine is like this:
+# [In]: engine = crawl_engine(dep_dict, max_concurrency=8, per_host=4)
+# [In]: result_df = engine.run([('Appliances', 'Dishwashers', 'LG', 10022), ('Appliances', 'Dishwashers', 'LG', 75209)])
+# The result is the combined dataframe of every job's run(), in job order, with the categorical columns kept: a job -
+# -listed twice has its rows twice, like pd.concat of the separate runs, although its pages are fetched only once.
+class crawl_engine:
+
+    # The classes default to homedepot_site_map and homedepot_crawler. The script passes its own classes in when it -
+    # -runs as __main__, so the jobs share the class-level proxy pool and user agent set up there.
+    def __init__(self, dep_dict=None, max_concurrency=8, per_host=4, crawler_class=None, site_map_class=None,
+                 strict=False):
+        if crawler_class is None or site_map_class is None:
+            import Homedepot_Crawler_Final_Siyao_Chen as crawler_module
+            crawler_class = crawler_class or crawler_module.homedepot_crawler
+            site_map_class = site_map_class or crawler_module.homedepot_site_map
+        self.crawler_class = crawler_class
+        self.site_map_class = site_map_class
+        self.dep_dict = dep_dict
+        self.max_concurrency = max_concurrency
+        self.limiter = fetch_limiter(max_concurrency, per_host)
+        self.strict = strict
+        self.last_plan = None
+        self.last_crawlers = []
+        self.incomplete = {}
+
+    def build_dep_dict(self):
+        site_map = self.site_map_class()
+        site_map.host_limiter = self.limiter
+        return site_map.run()
+
+    def make_crawler(self, job, page_executor, listing_url=None):
+        department, sub_department, brand, location = job
+        crawler = self.crawler_class(department, sub_department, brand, location, dep_dict=self.dep_dict)
+        crawler.host_limiter = self.limiter
+        crawler.page_executor = page_executor
+        crawler.listing_url = listing_url
+        return crawler
+
+    def prepare(self):
+        if self.dep_dict is None:
+            self.dep_dict = self.build_dep_dict()
+
+    # plan() fetches the brand pages on the job pool; the plan of the last run is kept in self.last_plan, so the -
+    # -unresolved jobs can be checked afterwards.
+    def plan(self, jobs, executor=None):
+        self.prepare()
+        plan = crawl_plan(jobs, self.dep_dict, crawler_class=self.crawler_class)
+        self.last_plan = plan.resolve(executor, self.limiter)
+        return plan
+
+    def make_crawlers(self, plan, page_executor):
+        return [self.make_crawler(job, page_executor, listing_url) for job, listing_url in plan.listings]
+
+    # A job whose pages still failed after its page_retries is logged and kept in self.incomplete as {job: failed -
+    # -page urls}; run() and stream() check their crawlers once every job has run, and raise if strict is set.
+    def check_complete(self, crawlers, result=None):
+        self.last_crawlers = crawlers
+        self.incomplete = {}
+        for crawler in crawlers:
+            if crawler.failed_pages:
+                job = (crawler.department, crawler.sub_department, crawler.brand, crawler.location)
+                self.incomplete[job] = list(crawler.failed_pages)
+        if self.incomplete:
+            logger.warning('%d of %d listing crawls are missing pages: %s', len(self.incomplete), len(crawlers),
+                           self.incomplete)
+            if self.strict:
+                raise crawl_incomplete(self.incomplete, result)
+        return result
+
+    def clear_checkpoints(self):
+        '''Remove the checkpoints of the last run's jobs that finished without failed pages.'''
+        for crawler in self.last_crawlers:
+            if not crawler.failed_pages:
+                crawler.clear_checkpoint()
+
+    # Jobs and pages run on separate pools, so a job waiting for its pages never holds a worker the pages need.
+    # The limiter, not the pool sizes, decides how many requests are actually in flight.
+    def run(self, jobs):
+        jobs = list(jobs)
+        self.prepare()
+        if not jobs:
+            return result_schema.concat_results([])
+        with ThreadPoolExecutor(self.max_concurrency) as page_pool, \
+                ThreadPoolExecutor(min(self.max_concurrency, len(jobs))) as job_pool:
+            plan = self.plan(jobs, job_pool)
+            crawlers = self.make_crawlers(plan, page_pool)
+            results = list(job_pool.map(lambda crawler: crawler.run(), crawlers))
+        return self.check_complete(crawlers, result_schema.concat_results(plan.per_job(results)))
+
+    # enqueue() is the producer side of a distributed crawl: it plans the jobs and adds their first pages to a -
+    # -crawl_frontier (frontier.py), whose page_workers then crawl them in any number of processes.
+    def enqueue(self, jobs, frontier):
+        jobs = list(jobs)
+        with ThreadPoolExecutor(max(1, min(self.max_concurrency, len(jobs)))) as job_pool:
+            plan = self.plan(jobs, job_pool)
+        return frontier.add_jobs(plan.listings)
+
+    # stream() runs the same jobs but hands every page to sink.write() as soon as it is parsed, instead of -
+    # -collecting everything into one dataframe. Rows of different jobs may interleave in the output, and every -
+    # -unique listing crawl of the plan is written once, however many requested jobs share it.
+    def stream(self, jobs, sink):
+        jobs = list(jobs)
+        self.prepare()
+        if not jobs:
+            return sink
+
+        def stream_job(crawler):
+            for records in crawler.iter_result_pages():
+                sink.write(records)
+
+        with ThreadPoolExecutor(self.max_concurrency) as page_pool, \
+                ThreadPoolExecutor(min(self.max_concurrency, len(jobs))) as job_pool:
+            crawlers = self.make_crawlers(self.plan(jobs, job_pool), page_pool)
+            list(job_pool.map(stream_job, crawlers))
+        sink.flush()
+        return self.check_complete(crawlers, sink)
@@ -0,0 +1,198 @@
+# coding: utf-8
+#!/usr/bin/env python
+"""Provides a declarative crawl matrix and a planner that shares location-independent fetches across jobs.
+
+A crawl matrix (YAML or CSV) lists departments x sub_departments x brands x store locations. load_matrix() expands
+it into (department, sub_department, brand, location) jobs, and crawl_plan turns the jobs into a fetch plan: the
+site map once, every category's brand page once (without a store cookie), and one listing crawl per unique
+(category, listing url, location). Only the listing requests carry the store cookie, so the number of requests
+grows with the unique pages instead of with the number of jobs.
+"""
+
+import csv
+import itertools
+import logging
+from collections import OrderedDict
+
+
+# Several values in one CSV cell are separated by MULTI_VALUE_SEP and expanded like a YAML list.
+MULTI_VALUE_SEP = ';'
+
+logger = logging.getLogger('homedepot_crawler.plan')
+
+
+def as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    if isinstance(value, str):
+        return [i.strip() for i in value.split(MULTI_VALUE_SEP) if i.strip()]
+    return [value]
+
+
+# The store cookies are keyed by the zip code as an int, so "10022" in a CSV file becomes 10022.
+def as_location(value):
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    return value
+
+
+def expand_entry(entry, default_locations=None):
+    '''Expand one matrix entry into its (department, sub_department, brand, location) jobs.'''
+    departments = as_list(entry.get('department'))
+    sub_departments = as_list(entry.get('sub_department'))
+    brands = as_list(entry.get('brands', entry.get('brand')))
+    locations = as_list(entry.get('locations', entry.get('location'))) or as_list(default_locations)
+    return [(department, sub_department, brand, as_location(location))
+            for department, sub_department, brand, location
+            in itertools.product(departments, sub_departments, brands, locations)]
+
+
+def expand_matrix(entries, default_locations=None):
+    '''Expand matrix entries into jobs, dropping repeated ones but keeping the first-seen order.'''
+    jobs = OrderedDict()
+    for entry in entries:
+        for job in expand_entry(entry, default_locations):
+            jobs.setdefault(job, None)
+    return list(jobs)
+
+
+# A YAML matrix has top-level default locations and a list of jobs; an entry can override the locations:
+#   locations: [10022, 75209]
+#   jobs:
+#     - {department: Appliances, sub_department: Dishwashers, brands: [LG, Samsung]}
+#     - {department: Bedroom Furniture, sub_department: Mattresses, brands: Sealy, locations: [10022]}
+# A CSV matrix has the header department,sub_department,brand,location, with "LG;Samsung" style cells allowed.
+def load_matrix(path):
+    '''Read a crawl matrix from a .yaml/.yml or .csv file and return its jobs.'''
+    if path.lower().endswith(('.yaml', '.yml')):
+        import yaml
+        with open(path, 'r', encoding='utf-8') as f:
+            spec = yaml.safe_load(f) or {}
+        if isinstance(spec, list):
+            spec = {'jobs': spec}
+        return expand_matrix(spec.get('jobs', []), spec.get('locations'))
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        return expand_matrix(csv.DictReader(f))
+
+
+# The plan is built in two steps: jobs are grouped first (no network), then resolve() fetches every category's -
+# -brand page once and looks up each job's listing url. An example usage is like this:
+# [In]: plan = crawl_plan(load_matrix('crawl_matrix.yaml'), dep_dict)
+# [In]: plan.resolve()
+# [In]: plan.listings    # [((department, sub_department, brand, location), listing url), ...]
+class crawl_plan:
+
+    # The crawler class defaults to homedepot_crawler, imported lazily like in crawl_engine.
+    def __init__(self, jobs, dep_dict, crawler_class=None):
+        if crawler_class is None:
+            import Homedepot_Crawler_Final_Siyao_Chen as crawler_module
+            crawler_class = crawler_module.homedepot_crawler
+        self.crawler_class = crawler_class
+        self.dep_dict = dep_dict
+        self.jobs = list(jobs)
+        # Jobs are the same crawl when they only differ in the case of the brand name.
+        self.brand_jobs = OrderedDict()
+        for department, sub_department, brand, location in self.jobs:
+            key = (department, sub_department, brand.lower())
+            locations = self.brand_jobs.setdefault(key, [])
+            if location not in locations:
+                locations.append(location)
+        self.brand_dicts = {}
+        self.listing_urls = {}
+        self.unresolved = []
+        self.errors = {}
+        self.listings = []
+        self.job_listings = {}
+
+    # The crawler built here has no location, so the brand page is fetched without a store cookie and the one copy -
+    # -(also in the response_cache) serves every store.
+    def brand_crawler(self, key, host_limiter=None):
+        department, sub_department, brand = key
+        crawler = self.crawler_class(department, sub_department, brand, None, dep_dict=self.dep_dict)
+        if host_limiter is not None:
+            crawler.host_limiter = host_limiter
+        return crawler
+
+    def source_urls(self):
+        '''Map every category url to the brand keys (department, sub_department, brand) crawled from it.'''
+        sources = OrderedDict()
+        for key in self.brand_jobs:
+            try:
+                source_url = self.brand_crawler(key).get_source_url()
+            except KeyError as e:
+                self.mark_unresolved(key, e)
+                continue
+            sources.setdefault(source_url, []).append(key)
+        return sources
+
+    def mark_unresolved(self, key, error):
+        self.unresolved.append(key)
+        self.errors[key] = error
+        logger.warning('%s|%s|%s is not crawled: %r', key[0], key[1], key[2], error)
+
+    # A job whose department, sub_department or brand is not on the site, or whose brand page could not be fetched -
+    # -or read (e.g. fetch_blocked after every retry, or a changed layout), is kept in unresolved, with its error in -
+    # -errors, instead of failing the whole plan; its rows are simply missing from the result.
+    def resolve(self, executor=None, host_limiter=None):
+        '''Fetch each brand page once and fill in listings, one entry per unique listing crawl.'''
+        self.unresolved = []
+        self.errors = {}
+        sources = self.source_urls()
+
+        def fetch_brand_dict(item):
+            source_url, keys = item
+            try:
+                return source_url, self.brand_crawler(keys[0], host_limiter).get_brand_dict(), None
+            except Exception as e:
+                return source_url, None, e
+
+        items = list(sources.items())
+        fetched = executor.map(fetch_brand_dict, items) if executor is not None else map(fetch_brand_dict, items)
+        self.brand_dicts = {}
+        for source_url, brand_dict, error in fetched:
+            if error is None:
+                self.brand_dicts[source_url] = brand_dict
+                continue
+            for key in sources[source_url]:
+                self.mark_unresolved(key, error)
+
+        self.listing_urls = {}
+        for source_url, keys in sources.items():
+            if source_url not in self.brand_dicts:
+                continue
+            for key in keys:
+                try:
+                    self.listing_urls[key] = self.brand_crawler(key).get_listing_url(self.brand_dicts[source_url])
+                except KeyError as e:
+                    self.mark_unresolved(key, e)
+        # Two brand names can lead to the same listing (e.g. "GE" and "GE Appliances"); it is crawled once per store.
+        listings = OrderedDict()
+        for key, locations in self.brand_jobs.items():
+            if key not in self.listing_urls:
+                continue
+            department, sub_department, brand = key
+            for location in locations:
+                listings.setdefault((department, sub_department, self.listing_urls[key], location),
+                                    (department, sub_department, brand, location))
+        self.listings = [(job, listing_key[2]) for listing_key, job in listings.items()]
+        index = {listing_key: i for i, listing_key in enumerate(listings)}
+        self.job_listings = {}
+        for job in self.jobs:
+            department, sub_department, brand, location = job
+            key = (department, sub_department, brand.lower())
+            if key in self.listing_urls:
+                self.job_listings[job] = index[(department, sub_department, self.listing_urls[key], location)]
+        return self
+
+    # A listing crawled once for several requested jobs (a repeated job, or "GE" and "GE Appliances") gives its -
+    # -result to each of them, so the combined result has the rows of every job; unresolved jobs get none.
+    def per_job(self, results):
+        '''Spread results, one per entry of listings, over the requested jobs in job order.'''
+        return [results[self.job_listings[job]] for job in self.jobs if job in self.job_listings]
+
+    def summary(self):
+        '''Counts of jobs and of the fetches the plan makes for them.'''
+        return {'jobs': len(self.jobs), 'listing_crawls': len(self.listings), 'brand_pages': len(self.brand_dicts),
+                'unresolved': len(self.unresolved)}
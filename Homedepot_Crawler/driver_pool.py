@@ -0,0 +1,138 @@
+# coding: utf-8
+#!/usr/bin/env python
+"""Provides a pool of reusable headless Chrome drivers for pages that really need a browser.
+
+The driver_pool class starts at most `size` headless drivers and hands them out to crawler threads, so the
+"load more" path does not start a new Chrome for every crawl. load_all() clicks the "load more" button with
+explicit waits (until more products show up or the button is gone) instead of a fixed time.sleep() per click.
+"""
+
+import threading
+from contextlib import contextmanager
+
+from selenium import webdriver
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from selenium.webdriver.chrome.service import Service
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+
+
+PRODUCT_SELECTOR = 'div#products a[data-pod-type="pr"]'
+LOAD_MORE_CLASS = 'js-load-more-btn'
+
+
+# chromedriver_path is optional; without it Selenium looks for chromedriver on the PATH.
+# An example usage is like this:
+# [In]: pool = driver_pool(size=2)
+# [In]: html = pool.load_all(url, cookies={'THD_PERSIST': '...'}, max_clicks=9)
+# [In]: pool.close()
+class driver_pool:
+
+    def __init__(self, size=2, chromedriver_path=None, headless=True, wait_timeout=10):
+        self.size = size
+        self.chromedriver_path = chromedriver_path
+        self.headless = headless
+        self.wait_timeout = wait_timeout
+        self.idle = []
+        self.started = 0
+        self._available = threading.Condition()
+
+    def _new_driver(self):
+        options = webdriver.ChromeOptions()
+        if self.headless:
+            options.add_argument('--headless=new')
+        options.add_argument('--disable-gpu')
+        options.add_argument('--blink-settings=imagesEnabled=false')
+        service = Service(self.chromedriver_path) if self.chromedriver_path else Service()
+        return webdriver.Chrome(service=service, options=options)
+
+    # A driver is started only when no idle one is left and the pool is not full; otherwise we wait until a driver -
+    # -comes back or a broken one frees its slot.
+    def _checkout(self):
+        with self._available:
+            while not self.idle:
+                if self.started < self.size:
+                    self.started += 1
+                    break
+                self._available.wait()
+            else:
+                return self.idle.pop()
+        try:
+            return self._new_driver()
+        except BaseException:
+            self._discard(None)
+            raise
+
+    def _discard(self, driver):
+        with self._available:
+            self.started -= 1
+            self._available.notify()
+        if driver is not None:
+            try:
+                driver.quit()
+            except Exception:
+                pass
+
+    # A driver goes back to the pool with its cookies cleared; one that cannot even do that is quit instead.
+    def _checkin(self, driver):
+        try:
+            driver.delete_all_cookies()
+        except Exception:
+            self._discard(driver)
+            return
+        with self._available:
+            self.idle.append(driver)
+            self._available.notify()
+
+    # A driver that broke while in use is quit and replaced instead of going back to the pool; any other error -
+    # -raised while it was in use still returns it.
+    @contextmanager
+    def driver(self):
+        driver = self._checkout()
+        try:
+            yield driver
+        except WebDriverException:
+            self._discard(driver)
+            raise
+        except BaseException:
+            self._checkin(driver)
+            raise
+        else:
+            self._checkin(driver)
+
+    def load_all(self, url, cookies=None, max_clicks=None):
+        '''Open url with cookies, click "load more" until every product is shown and return the page source.'''
+        with self.driver() as driver:
+            # Cookies can only be set for the domain that is open, so the page is loaded once before setting them.
+            driver.get(url)
+            if cookies:
+                for name, value in cookies.items():
+                    driver.add_cookie({'name': name, 'value': value})
+                driver.get(url)
+            wait = WebDriverWait(driver, self.wait_timeout)
+            clicks = 0
+            while max_clicks is None or clicks < max_clicks:
+                try:
+                    button = wait.until(EC.element_to_be_clickable((By.CLASS_NAME, LOAD_MORE_CLASS)))
+                except TimeoutException:
+                    break
+                shown = len(driver.find_elements(By.CSS_SELECTOR, PRODUCT_SELECTOR))
+                button.click()
+                clicks += 1
+                try:
+                    wait.until(lambda d: len(d.find_elements(By.CSS_SELECTOR, PRODUCT_SELECTOR)) > shown)
+                except TimeoutException:
+                    break
+            return driver.page_source
+
+    def close(self):
+        with self._available:
+            drivers, self.idle = self.idle, []
+            self.started -= len(drivers)
+            self._available.notify_all()
+        for driver in drivers:
+            try:
+                driver.quit()
+            except Exception:
+                pass
@@ -0,0 +1,102 @@
+# coding: utf-8
+#!/usr/bin/env python
+"""Provides the product detail enrichment stage of the homedepot crawler.
+
+The detail_enricher class takes the product links of the listing output, drops repeated links (the same product
+is listed in several stores and jobs), fetches every product page once with bounded concurrency and extracts
+rating, review count, model, SKU and availability with prod_parser.extract_product_details(). Details are
+streamed to a record_sink in batches, or collected and joined back onto the result by Product link.
+"""
+
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import pandas as pd
+
+import prod_parser
+import result_schema
+
+
+# Product pages are fetched without a store cookie, so one fetch serves every location; availability is therefore -
+# -the site-wide value, not the store's.
+# An example usage is like this:
+# [In]: enricher = detail_enricher(max_concurrency=16)
+# [In]: enriched_df = enricher.enrich(result_df)
+# [In]: with csv_sink('product_details.csv', frame_builder=result_schema.details_to_frame) as sink:
+# [In]:     enricher.stream(result_df['Product link'], sink)
+class detail_enricher:
+
+    # fetcher is a homedepot_site_map whose fetch_html() is used, so the shared proxy and session pools, the -
+    # -response_cache and the metrics apply to product pages too. host_limiter (e.g. crawl_engine.limiter) -
+    # -keeps the detail requests under the same per-host cap as the listing crawl.
+    def __init__(self, fetcher=None, max_concurrency=16, host_limiter=None):
+        if fetcher is None:
+            import Homedepot_Crawler_Final_Siyao_Chen as crawler_module
+            fetcher = crawler_module.homedepot_site_map()
+        if host_limiter is not None:
+            fetcher.host_limiter = host_limiter
+        self.fetcher = fetcher
+        self.max_concurrency = max_concurrency
+        self.failed = []
+        self._lock = threading.Lock()
+
+    def unique_urls(self, urls, known=()):
+        '''The product links in first-seen order, without repeats, missing values and links in known.'''
+        seen = set(known)
+        unique = []
+        for url in urls:
+            if url is None or url is pd.NA or (isinstance(url, float) and url != url) or url in seen:
+                continue
+            seen.add(url)
+            unique.append(url)
+        return unique
+
+    # A page that could not be fetched or parsed is left out and kept in self.failed, so a later run can retry it.
+    def fetch_details(self, url):
+        try:
+            details = prod_parser.extract_product_details(self.fetcher.fetch_html(url))
+        except Exception:
+            with self._lock:
+                self.failed.append(url)
+            return None
+        details["Product link"] = url
+        return details
+
+    # At most 2 * max_concurrency pages are in flight or waiting to be consumed, so memory stays flat however many -
+    # -links there are. Details come out in the order they finish, not in link order.
+    def iter_details(self, urls, known=()):
+        urls = iter(self.unique_urls(urls, known))
+        with ThreadPoolExecutor(self.max_concurrency) as pool:
+            pending = set()
+            for url in urls:
+                pending.add(pool.submit(self.fetch_details, url))
+                if len(pending) < 2 * self.max_concurrency:
+                    continue
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.result() is not None:
+                        yield future.result()
+            for future in pending:
+                if future.result() is not None:
+                    yield future.result()
+
+    def stream(self, urls, sink, known=(), batch_size=500):
+        '''Write the details of urls to a record_sink, handing it batch_size records at a time.'''
+        batch = []
+        for details in self.iter_details(urls, known):
+            batch.append(details)
+            if len(batch) >= batch_size:
+                sink.write(batch)
+                batch = []
+        if batch:
+            sink.write(batch)
+        sink.flush()
+        return sink
+
+    def run(self, urls, known=()):
+        '''Fetch the details of urls and return them as a typed table (result_schema.DETAIL_COLUMNS).'''
+        return result_schema.details_to_frame(list(self.iter_details(urls, known)))
+
+    def enrich(self, result_df):
+        '''Return result_df with the detail columns joined on by Product link.'''
+        return result_schema.join_details(result_df, self.run(result_df["Product link"]))
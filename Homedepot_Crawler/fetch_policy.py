@@ -0,0 +1,161 @@
+# coding: utf-8
+#!/usr/bin/env python
+"""Provides the fetch policy of the homedepot crawler: adaptive rate limits, backoff and block-page detection.
+
+The fetch_policy class gives every host a token bucket whose rate adapts to what the site tolerates (additive
+increase on success, multiplicative decrease when it throttles, a pause for Retry-After), sleeps a jittered
+exponential backoff between tries, sets (connect, read) timeouts, and classifies every response as ok,
+throttled (429), blocked (403 or a captcha/denial page), unavailable (5xx) or final. homedepot_site_map uses the
+verdict to retry instead of parsing a block page, and trips the proxy's circuit breaker in proxy_pool when the
+site refuses that proxy.
+"""
+
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+OK = 'ok'
+THROTTLED = 'throttled'
+BLOCKED = 'blocked'
+UNAVAILABLE = 'unavailable'
+# Markers of a bot-check or denial page, matched case-insensitively in short pages only; real listing pages are -
+# -far larger than max_block_page_bytes.
+BLOCK_MARKERS = ('captcha', 'access denied', 'pardon our interruption', 'are you a robot', 'request unsuccessful')
+
+
+# fetch_blocked is raised when every try of a request was throttled or blocked, so the caller never parses the -
+# -block page. It is an IOError, so the page retry and checkpoint logic treat it like a failed fetch.
+class fetch_blocked(IOError):
+
+    def __init__(self, url, verdict, status):
+        super().__init__('{} ({}, HTTP {}): {}'.format(verdict, url, status, 'every try was refused'))
+        self.url = url
+        self.verdict = verdict
+        self.status = status
+
+
+def retry_after(response):
+    '''The Retry-After header in seconds, or None if it is missing or an HTTP date.'''
+    value = response.headers.get('Retry-After')
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+# A token bucket refilled at rate tokens per second, holding at most burst tokens. A request takes its token right -
+# -away and sleeps off the debt outside the lock, so waiting threads queue up at the rate instead of all at once.
+class host_bucket:
+
+    def __init__(self, rate, burst, min_rate, max_rate):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = max(-self.tokens / self.rate, self.paused_until - now, 0.0)
+        if wait > 0:
+            time.sleep(wait)
+
+    def increase(self, step):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + step)
+
+    # Concurrent requests often get throttled together; the rate is only cut once per second for them.
+    def decrease(self, factor, pause=None):
+        with self._lock:
+            now = time.monotonic()
+            if now - self.last_decrease >= 1.0:
+                self.rate = max(self.min_rate, self.rate * factor)
+                self.last_decrease = now
+            if pause:
+                self.paused_until = max(self.paused_until, now + pause)
+
+
+# rate is the starting requests per second per host, adapted between min_rate and max_rate; rate=None turns the -
+# -rate limit off (e.g. against a local stand-in site) but keeps backoff and block detection.
+# An example usage is like this:
+# [In]: homedepot_site_map.shared_fetch_policy = fetch_policy(rate=2.0, max_rate=10.0)
+# [In]: result_df = homedepot_crawler('Appliances', 'Dishwashers', 'LG', 10022).run()
+# [In]: homedepot_site_map.shared_fetch_policy.snapshot()    # {'www.homedepot.com': 7.35}
+class fetch_policy:
+
+    def __init__(self, rate=4.0, burst=4, min_rate=0.25, max_rate=50.0, increase=0.05, decrease=0.5,
+                 base_delay=0.5, max_delay=30.0, max_tries=5, direct_tries=3, timeout=(5, 30), proxy_cooldown=60,
+                 max_block_page_bytes=32768):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_tries = max_tries
+        self.direct_tries = direct_tries
+        self.timeout = timeout
+        self.proxy_cooldown = proxy_cooldown
+        self.max_block_page_bytes = max_block_page_bytes
+        self.buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self.buckets:
+                self.buckets[host] = host_bucket(self.rate, self.burst, self.min_rate, self.max_rate)
+            return self.buckets[host]
+
+    def wait(self, url):
+        '''Block until the host of url may get another request.'''
+        if self.rate is not None:
+            self.bucket(url).acquire()
+
+    def classify(self, response):
+        '''Return the verdict for a response: ok, throttled, blocked, unavailable; other statuses are ok (final).'''
+        status = response.status_code
+        if status == 429:
+            return THROTTLED
+        if status == 403:
+            return BLOCKED
+        if status >= 500:
+            return UNAVAILABLE
+        if status == 200 and len(response.content) <= self.max_block_page_bytes:
+            text = response.text.lower()
+            if any(marker in text for marker in BLOCK_MARKERS):
+                return BLOCKED
+        return OK
+
+    # A throttled or unavailable host gets a lower rate (and a pause for Retry-After); a blocked response only -
+    # -says something about the proxy, so the host rate is left alone.
+    def record(self, url, verdict, response=None):
+        if self.rate is None:
+            return
+        if verdict == OK:
+            self.bucket(url).increase(self.increase)
+        elif verdict in (THROTTLED, UNAVAILABLE):
+            self.bucket(url).decrease(self.decrease, retry_after(response) if response is not None else None)
+
+    def delay(self, attempt, response=None):
+        '''Full-jitter exponential backoff before try attempt + 1, at least the response's Retry-After.'''
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        after = retry_after(response) if response is not None else None
+        return max(delay, min(after, self.max_delay)) if after is not None else delay
+
+    def snapshot(self):
+        '''Return {host: current requests per second} for monitoring.'''
+        with self._lock:
+            return {host: bucket.rate for host, bucket in self.buckets.items()}
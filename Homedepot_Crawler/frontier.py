@@ -0,0 +1,305 @@
+# coding: utf-8
+#!/usr/bin/env python
+"""Provides a crawl frontier of listing page tasks that several worker processes can pull from.
+
+The crawl_frontier class keeps one task per listing page (department, sub_department, brand, location, listing
+url and "Nao" offset) in SQLite. Workers lease tasks for a visibility timeout; a task whose lease runs out goes
+back to the queue, a failed task is retried after a delay until max_attempts, and the records of a finished page
+are stored in the same transaction that marks it done, so the results table is the shared sink of every worker
+and a page is never counted twice. A producer only adds the first page of each job (crawl_engine.enqueue() or
+homedepot_crawler.enqueue()); the worker that reads a first page adds the job's other pages.
+
+    python frontier.py worker crawl.db --processes 4 --threads 4
+    python frontier.py status crawl.db
+    python frontier.py export crawl.db result_df.csv
+"""
+
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+from collections import namedtuple
+from contextlib import contextmanager
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    department TEXT NOT NULL,
+    sub_department TEXT NOT NULL,
+    brand TEXT NOT NULL,
+    location NOT NULL,
+    listing_url TEXT NOT NULL,
+    nao INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    error TEXT,
+    UNIQUE (department, sub_department, listing_url, location, nao)
+);
+CREATE INDEX IF NOT EXISTS tasks_queue ON tasks (status, available_at);
+CREATE TABLE IF NOT EXISTS results (
+    task_id INTEGER PRIMARY KEY,
+    records TEXT NOT NULL
+);
+"""
+
+TASK_COLUMNS = 'id, department, sub_department, brand, location, listing_url, nao, attempts, lease_owner'
+
+# A leased task; (id, lease_owner, attempts) is the lease token checked by complete(), fail() and extend().
+page_task = namedtuple('page_task', TASK_COLUMNS.replace(',', ''))
+
+
+# The task statuses are 'pending', 'leased', 'done' and 'failed' (out of attempts).
+# An example usage is like this:
+# [In]: frontier = crawl_frontier('crawl.db')
+# [In]: crawl_engine(dep_dict).enqueue(jobs, frontier)      # producer
+# [In]: page_worker(frontier, threads=4).run()               # in as many processes as you like
+# [In]: frontier.export(csv_sink('result_df.csv'))
+# Every process opens its own crawl_frontier on the same file; SQLite locking keeps the leases consistent.
+class crawl_frontier:
+
+    def __init__(self, path, visibility_timeout=300, max_attempts=3, retry_delay=5):
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+
+    # BEGIN IMMEDIATE takes the write lock up front, so two workers can never lease the same task.
+    @contextmanager
+    def transaction(self):
+        with self._lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+            self.conn.execute('COMMIT')
+
+    def _insert_tasks(self, conn, rows):
+        before = conn.total_changes
+        conn.executemany('INSERT OR IGNORE INTO tasks (department, sub_department, brand, location, listing_url, nao) '
+                         'VALUES (?, ?, ?, ?, ?, ?)', rows)
+        return conn.total_changes - before
+
+    def add_jobs(self, listings):
+        '''Add the first page of every (job, listing url) pair, e.g. crawl_plan.listings; returns the number added.'''
+        rows = [(department, sub_department, brand, location, listing_url, 0)
+                for (department, sub_department, brand, location), listing_url in listings]
+        with self.transaction() as conn:
+            return self._insert_tasks(conn, rows)
+
+    # A leased task whose lease ran out is handed out again, unless it has used up its attempts; then it fails.
+    def lease(self, worker_id, limit=1):
+        '''Lease up to limit tasks for visibility_timeout seconds and return them.'''
+        now = time.time()
+        with self.transaction() as conn:
+            conn.execute("UPDATE tasks SET status = 'failed', error = COALESCE(error, 'lease expired') "
+                         "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?", (now, self.max_attempts))
+            rows = conn.execute(
+                'SELECT {} FROM tasks WHERE (status = \'pending\' AND available_at <= ?) '
+                'OR (status = \'leased\' AND lease_expires < ?) ORDER BY id LIMIT ?'.format(TASK_COLUMNS),
+                (now, now, limit)).fetchall()
+            conn.executemany("UPDATE tasks SET status = 'leased', attempts = attempts + 1, lease_owner = ?, "
+                             "lease_expires = ? WHERE id = ?",
+                             [(worker_id, now + self.visibility_timeout, row[0]) for row in rows])
+        return [page_task(*row[:7], row[7] + 1, worker_id) for row in rows]
+
+    def _owned(self, task):
+        return ('id = ? AND lease_owner = ? AND attempts = ? AND status = \'leased\'',
+                (task.id, task.lease_owner, task.attempts))
+
+    def extend(self, task):
+        '''Push the lease of a long-running task out by another visibility_timeout; False if it was lost.'''
+        where, args = self._owned(task)
+        with self.transaction() as conn:
+            cursor = conn.execute('UPDATE tasks SET lease_expires = ? WHERE ' + where,
+                                  (time.time() + self.visibility_timeout,) + args)
+        return cursor.rowcount == 1
+
+    # The records and the job's other pages are only stored if the lease is still ours; a worker that was too slow -
+    # -finds its task handed to another worker and its result is dropped.
+    def complete(self, task, records, next_offsets=()):
+        '''Mark a task done, store its records and add the pages found on a first page; False if the lease was lost.'''
+        where, args = self._owned(task)
+        with self.transaction() as conn:
+            cursor = conn.execute("UPDATE tasks SET status = 'done', lease_expires = NULL, error = NULL WHERE " + where,
+                                  args)
+            if cursor.rowcount != 1:
+                return False
+            conn.execute('INSERT OR REPLACE INTO results (task_id, records) VALUES (?, ?)',
+                         (task.id, json.dumps(records)))
+            self._insert_tasks(conn, [(task.department, task.sub_department, task.brand, task.location,
+                                       task.listing_url, nao) for nao in next_offsets])
+        return True
+
+    def fail(self, task, error):
+        '''Put a task back in the queue after retry_delay * attempts seconds, or fail it after max_attempts.'''
+        where, args = self._owned(task)
+        status = 'failed' if task.attempts >= self.max_attempts else 'pending'
+        with self.transaction() as conn:
+            conn.execute('UPDATE tasks SET status = ?, available_at = ?, lease_expires = NULL, error = ? WHERE ' + where,
+                         (status, time.time() + self.retry_delay * task.attempts, str(error)[:2000]) + args)
+
+    def counts(self):
+        with self._lock:
+            rows = self.conn.execute('SELECT status, COUNT(*) FROM tasks GROUP BY status').fetchall()
+        return dict(rows)
+
+    def is_drained(self):
+        '''True once no task is pending or leased any more.'''
+        counts = self.counts()
+        return not counts.get('pending') and not counts.get('leased')
+
+    def failed_tasks(self):
+        with self._lock:
+            return self.conn.execute('SELECT id, department, sub_department, brand, location, nao, error FROM tasks '
+                                     "WHERE status = 'failed' ORDER BY id").fetchall()
+
+    def retry_failed(self):
+        '''Queue the failed tasks again with fresh attempts.'''
+        with self.transaction() as conn:
+            return conn.execute("UPDATE tasks SET status = 'pending', attempts = 0, available_at = 0 "
+                                "WHERE status = 'failed'").rowcount
+
+    # Results come out grouped by job and in page order, like the rows of homedepot_crawler.run().
+    def iter_results(self):
+        with self._lock:
+            rows = self.conn.execute('SELECT r.records FROM results r JOIN tasks t ON t.id = r.task_id ORDER BY '
+                                     'MIN(t.id) OVER (PARTITION BY t.department, t.sub_department, t.listing_url, '
+                                     't.location), t.nao').fetchall()
+        for (records,) in rows:
+            yield json.loads(records)
+
+    def export(self, sink):
+        '''Write every stored record to a record_sink (record_sink.py) and flush it.'''
+        for records in self.iter_results():
+            sink.write(records)
+        sink.flush()
+        return sink
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+# The page_worker is stateless: everything a page needs is in its task, so workers can be started and killed at -
+# -any time. threads > 1 runs that many lease loops in the process (one page each at a time).
+class page_worker:
+
+    # The crawler class defaults to homedepot_crawler, imported lazily like in crawl_engine.
+    def __init__(self, frontier, crawler_class=None, worker_id=None, threads=1, poll_interval=1.0):
+        if crawler_class is None:
+            import Homedepot_Crawler_Final_Siyao_Chen as crawler_module
+            crawler_class = crawler_module.homedepot_crawler
+        self.frontier = frontier
+        self.crawler_class = crawler_class
+        self.worker_id = worker_id or '{}:{}'.format(socket.gethostname(), os.getpid())
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self.processed = 0
+        self._lock = threading.Lock()
+
+    def make_crawler(self, task):
+        crawler = self.crawler_class(task.department, task.sub_department, task.brand, task.location, dep_dict={})
+        crawler.listing_url = task.listing_url
+        return crawler
+
+    def process(self, task):
+        try:
+            records, next_offsets = self.make_crawler(task).run_page(task.nao)
+        except Exception as e:
+            self.frontier.fail(task, '{}: {}'.format(type(e).__name__, e))
+            return False
+        return self.frontier.complete(task, records, next_offsets)
+
+    # A first page can add more tasks when it completes, so a worker only stops once nothing is pending or leased.
+    def work(self, worker_id, stop_when_drained=True):
+        while True:
+            tasks = self.frontier.lease(worker_id)
+            if not tasks:
+                if stop_when_drained and self.frontier.is_drained():
+                    return
+                time.sleep(self.poll_interval)
+                continue
+            for task in tasks:
+                if self.process(task):
+                    with self._lock:
+                        self.processed += 1
+
+    def run(self, stop_when_drained=True):
+        '''Work until the frontier is drained (or forever) and return the number of pages this worker completed.'''
+        if self.threads == 1:
+            self.work(self.worker_id, stop_when_drained)
+            return self.processed
+        threads = [threading.Thread(target=self.work, args=('{}/{}'.format(self.worker_id, i), stop_when_drained),
+                                    daemon=True) for i in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.processed
+
+
+def run_worker(path, threads, site_url=None):
+    if site_url is not None:
+        import Homedepot_Crawler_Final_Siyao_Chen as crawler_module
+        crawler_module.homedepot_site_map.site_url = site_url
+    try:
+        return page_worker(crawl_frontier(path), threads=threads).run()
+    except Exception:
+        traceback.print_exc()
+        raise
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Work on or inspect a crawl frontier.')
+    parser.add_argument('command', choices=['worker', 'status', 'export', 'retry'])
+    parser.add_argument('frontier', help='the SQLite file of the frontier')
+    parser.add_argument('output', nargs='?', help='export: .csv or .parquet file')
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--site-url', default=None, help='crawl a stand-in site instead of homedepot.com')
+    args = parser.parse_args(argv)
+
+    if args.command == 'worker':
+        if args.processes == 1:
+            print(run_worker(args.frontier, args.threads, args.site_url))
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(args.processes) as pool:
+                futures = [pool.submit(run_worker, args.frontier, args.threads, args.site_url)
+                           for _ in range(args.processes)]
+                print(sum(future.result() for future in futures))
+    elif args.command == 'status':
+        frontier = crawl_frontier(args.frontier)
+        print(json.dumps(frontier.counts(), sort_keys=True))
+        for row in frontier.failed_tasks():
+            print(row)
+    elif args.command == 'retry':
+        print(crawl_frontier(args.frontier).retry_failed())
+    else:
+        import result_schema
+        from record_sink import csv_sink, parquet_sink
+        sink_class = parquet_sink if args.output.endswith('.parquet') else csv_sink
+        with sink_class(args.output, columns=result_schema.COLUMNS, frame_builder=result_schema.records_to_frame) as sink:
+            crawl_frontier(args.frontier).export(sink)
+        print(sink.rows_written)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
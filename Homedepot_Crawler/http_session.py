@@ -0,0 +1,78 @@
+# coding: utf-8
+#!/usr/bin/env python
+"""Provides a shared, pooled HTTP session layer for the homedepot crawler.
+
+The session_pool class keeps one requests.Session per (proxy, store location) pair, so connections to
+homedepot.com are kept alive and reused across pages and crawler instances instead of opening a new TCP+TLS
+connection for every request. Each location's session carries that store's default cookies.
+"""
+
+import threading
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+# pool_connections is the number of hosts a session keeps pools for, pool_maxsize the number of keep-alive -
+# -connections per host; set pool_maxsize to at least the crawl concurrency so threads do not queue for a socket.
+# timeout is used for every request that does not pass its own, and max_sessions bounds the number of proxies -
+# -we keep sessions for (the least recently used one is closed first).
+# An example usage is like this:
+# [In]: pool = session_pool(pool_maxsize=16, timeout=20)
+# [In]: r = pool.get('https://www.homedepot.com/c/site_map', proxy='1.2.3.4:8080', location=10022, cookies=cookies)
+class session_pool:
+
+    def __init__(self, pool_connections=10, pool_maxsize=20, timeout=30, max_sessions=64):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.timeout = timeout
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _new_session(self, proxy, cookies):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        # Every homedepot.com page is https, so the proxy has to be set for both schemes to be used at all.
+        if proxy is not None:
+            session.proxies = {'http': 'http://' + proxy, 'https': 'http://' + proxy}
+        if cookies:
+            session.cookies.update(cookies)
+        return session
+
+    def get_session(self, proxy=None, location=None, cookies=None):
+        '''Return the session for (proxy, location), creating it with the location's default cookies.'''
+        key = (proxy, location)
+        with self._lock:
+            session = self.sessions.get(key)
+            if session is not None:
+                self.sessions.move_to_end(key)
+                return session
+            session = self._new_session(proxy, cookies)
+            self.sessions[key] = session
+            while len(self.sessions) > self.max_sessions:
+                _, oldest = self.sessions.popitem(last=False)
+                oldest.close()
+            return session
+
+    # Requests are sent outside of the lock. requests.Session can be shared across threads for plain GETs, and -
+    # -its adapters hand every thread its own connection from the pool, so this works from a threaded crawl -
+    # -or from asyncio through loop.run_in_executor().
+    def get(self, url, proxy=None, location=None, cookies=None, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self.get_session(proxy, location, cookies).get(url, **kwargs)
+
+    def discard(self, proxy):
+        '''Close every session that goes through proxy, e.g. after the proxy pool evicted it.'''
+        with self._lock:
+            for key in [k for k in self.sessions if k[0] == proxy]:
+                self.sessions.pop(key).close()
+
+    def close(self):
+        with self._lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions.clear()
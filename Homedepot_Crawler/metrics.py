@@ -0,0 +1,219 @@
+# coding: utf-8
+#!/usr/bin/env python
+"""Provides hot-path instrumentation for the homedepot crawler: request, retry, proxy and parse metrics.
+
+The crawl_metrics class counts and times every request (status, bytes, proxy tries, direct-connection
+fallbacks, cache hits, time spent waiting for a host slot), every proxy attempt (latency and errors per proxy),
+proxy list downloads and every parse by parser. snapshot() returns the numbers as a dict, to_json() and
+to_prometheus() render them, and with log_events=True every request and parse is also logged as one JSON line.
+Instrumentation is off until homedepot_site_map.metrics is set; then the hot path only checks one attribute.
+profiled() wraps a block in cProfile and dumps the stats to a file.
+"""
+
+import cProfile
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+logger = logging.getLogger('homedepot_crawler.metrics')
+
+# Upper bounds (seconds) of the latency histogram buckets; the last bucket is +Inf.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+METRIC_PREFIX = 'homedepot_'
+
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for name, value in pairs) + '}'
+
+
+# A histogram keeps count, sum, max and the cumulative bucket counts of one metric with one label set.
+class histogram:
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+
+    def as_dict(self):
+        return {'count': self.count, 'sum': self.sum, 'max': self.max,
+                'mean': self.sum / self.count if self.count else None}
+
+
+# An example usage is like this:
+# [In]: homedepot_site_map.metrics = crawl_metrics(log_events=True)
+# [In]: result_df = homedepot_crawler('Appliances', 'Dishwashers', 'LG', 10022).run()
+# [In]: homedepot_site_map.metrics.write('metrics.prom')    # or 'metrics.json'
+class crawl_metrics:
+
+    def __init__(self, log_events=False, buckets=LATENCY_BUCKETS):
+        self.log_events = log_events
+        self.buckets = buckets
+        self.counters = {}
+        self.histograms = {}
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, label_key(labels))
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = histogram(self.buckets)
+            self.histograms[key].observe(value)
+
+    def event(self, event_name, **fields):
+        if self.log_events and logger.isEnabledFor(logging.INFO):
+            fields['event'] = event_name
+            fields['ts'] = time.time()
+            logger.info(json.dumps(fields, default=str))
+
+    # via is 'proxy' or 'direct' (the fallback after the proxies failed); tries counts the proxies tried.
+    def request(self, url, status, seconds, nbytes, tries, via, wait=0.0, error=None):
+        outcome = 'error' if error is not None else str(status)
+        self.inc('requests_total', status=outcome, via=via)
+        self.inc('response_bytes_total', nbytes)
+        self.inc('proxy_retries_total', max(tries - 1, 0) if via == 'proxy' else tries)
+        self.observe('request_seconds', seconds, via=via)
+        self.observe('slot_wait_seconds', wait)
+        self.event('request', url=url, status=status, seconds=round(seconds, 6), bytes=nbytes, tries=tries,
+                   via=via, wait=round(wait, 6), error=error)
+
+    def cache_hit(self, url):
+        self.inc('cache_hits_total')
+        self.event('cache_hit', url=url)
+
+    def proxy_attempt(self, proxy, ok, seconds):
+        self.inc('proxy_attempts_total', proxy=proxy, outcome='ok' if ok else 'error')
+        if ok:
+            self.observe('proxy_latency_seconds', seconds, proxy=proxy)
+
+    # verdict is the fetch policy's classification of one response: ok, throttled, blocked or unavailable.
+    def verdict(self, url, verdict, status, via):
+        self.inc('fetch_verdicts_total', verdict=verdict, via=via)
+        if verdict != 'ok':
+            self.event('refused', url=url, verdict=verdict, status=status, via=via)
+
+    def proxy_list(self, seconds, count, error=None):
+        self.inc('proxy_list_fetches_total', outcome='error' if error is not None else 'ok')
+        self.observe('proxy_list_seconds', seconds)
+        self.event('proxy_list', seconds=round(seconds, 6), proxies=count, error=error)
+
+    def parse(self, kind, parser, seconds, nbytes=None):
+        self.observe('parse_seconds', seconds, kind=kind, parser=parser)
+        self.event('parse', kind=kind, parser=parser, seconds=round(seconds, 6), bytes=nbytes)
+
+    def snapshot(self):
+        '''All counters and histograms as a JSON-ready dict, keyed by metric name and then by label set.'''
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = {key: value.as_dict() for key, value in self.histograms.items()}
+        result = {'uptime_seconds': time.time() - self.started, 'counters': {}, 'histograms': {}}
+        for (name, key), value in sorted(counters.items()):
+            result['counters'].setdefault(name, {})[format_labels(key) or 'total'] = value
+        for (name, key), value in sorted(histograms.items()):
+            result['histograms'].setdefault(name, {})[format_labels(key) or 'all'] = value
+        return result
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2, sort_keys=True)
+
+    def to_prometheus(self):
+        '''The metrics in the Prometheus text exposition format.'''
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
+            seen = set()
+            for (name, key), value in counters:
+                metric = METRIC_PREFIX + name
+                if metric not in seen:
+                    seen.add(metric)
+                    lines.append('# TYPE {} counter'.format(metric))
+                lines.append('{}{} {}'.format(metric, format_labels(key), value))
+            for (name, key), value in histograms:
+                metric = METRIC_PREFIX + name
+                if metric not in seen:
+                    seen.add(metric)
+                    lines.append('# TYPE {} histogram'.format(metric))
+                for bound, count in value.cumulative():
+                    lines.append('{}_bucket{} {}'.format(metric, format_labels(key, [('le', bound)]), count))
+                lines.append('{}_bucket{} {}'.format(metric, format_labels(key, [('le', '+Inf')]), value.count))
+                lines.append('{}_sum{} {}'.format(metric, format_labels(key), value.sum))
+                lines.append('{}_count{} {}'.format(metric, format_labels(key), value.count))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        '''Write the snapshot to path, as Prometheus text for .prom/.txt files and as JSON otherwise.'''
+        payload = self.to_prometheus() if path.endswith(('.prom', '.txt')) else self.to_json() + '\n'
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(payload)
+
+
+# timed_parse() wraps a parser method of homedepot_crawler. While self.metrics is None it only adds the attribute -
+# -check; parser names the parser for the label, otherwise the crawler's prod_parser setting is used.
+def timed_parse(kind, parser=None):
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(self, page, *args, **kw):
+            metrics = self.metrics
+            if metrics is None:
+                return func(self, page, *args, **kw)
+            start = time.perf_counter()
+            try:
+                return func(self, page, *args, **kw)
+            finally:
+                metrics.parse(kind, parser or self.prod_parser, time.perf_counter() - start,
+                              len(page) if isinstance(page, str) else None)
+        return wrapper
+    return decorate
+
+
+# cProfile only sees the thread it is enabled in, so wrap a single job's run() (or the whole script) with it.
+# [In]: with profiled('profiles/lg_10022.prof'):
+# [In]:     result_df = crawler.run()
+# [In]: python -m pstats profiles/lg_10022.prof
+@contextmanager
+def profiled(path):
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        profiler.dump_stats(path)
@@ -0,0 +1,198 @@
+# coding: utf-8
+#!/usr/bin/env python
+"""Provides a two-stage fetch/parse pipeline with a process-pool parser stage.
+
+The fetch_parse_pipeline class runs the listing pages of many jobs through two stages: I/O threads fetch the raw
+html into a bounded queue, and a process pool parses it with the module-level extractors of prod_parser.py, so
+parsing uses every core instead of competing with the fetch threads for the GIL. When the parsers fall behind,
+the queue fills up and the fetch threads wait, so memory is bounded by queue_size + max_parsing pages in flight.
+"""
+
+import multiprocessing
+import os
+import queue
+import threading
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import prod_parser
+import result_schema
+
+
+# Forking a process while fetch threads hold locks is unsafe, so the parse workers are started by a fork server.
+def parse_context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+# One unit of work: the page of a crawler at a "Nao" offset (0 is the first page), and how often it was fetched.
+class page_item:
+
+    def __init__(self, crawler, offset, attempt=0):
+        self.crawler = crawler
+        self.offset = offset
+        self.attempt = attempt
+        self.html = None
+
+    def url(self):
+        url1 = self.crawler.get_listing_url()
+        return url1.format(self.offset) if self.offset else url1.replace('&Nao={}', '')
+
+    def parse_call(self):
+        crawler = self.crawler
+        if self.offset:
+            return prod_parser.extract_prod_info, (self.html, crawler.site_url)
+        load_more = crawler.sub_department == 'Mattresses'
+        return prod_parser.extract_first_page, (self.html, crawler.site_url, load_more, crawler.load_more_page_size)
+
+
+# The pipeline takes its jobs through a crawl_engine, so they are planned (one brand page per category) and share -
+# -the engine's request limiter. fetch_workers threads fetch, parse_workers processes parse (default: one per -
+# -core), queue_size fetched pages may wait for a parser and max_parsing pages may be in the pool at once.
+# An example usage is like this:
+# [In]: pipeline = fetch_parse_pipeline(crawl_engine(dep_dict), fetch_workers=16, queue_size=64)
+# [In]: result_df = pipeline.run(jobs)
+# The pipeline always parses with lxml and pages "load more" listings over http; checkpoints and delta mode -
+# -belong to homedepot_crawler.iter_page_info() and are not used here.
+class fetch_parse_pipeline:
+
+    def __init__(self, engine, fetch_workers=8, parse_workers=None, queue_size=64, max_parsing=None):
+        self.engine = engine
+        self.fetch_workers = fetch_workers
+        self.parse_workers = parse_workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.max_parsing = max_parsing or 2 * self.parse_workers
+
+    # iter_pages() yields (crawler, page) in the order pages finish; page is None for a job with nothing on display.
+    # The main thread only moves results: a first page schedules the fetches of its other pages, a failed fetch -
+    # -is requeued up to the crawler's page_retries, and the loop ends when nothing is outstanding.
+    def iter_pages(self, jobs):
+        jobs = list(jobs)
+        if not jobs:
+            return
+        fetched = queue.Queue(self.queue_size)
+        results = queue.Queue()
+        parse_slots = threading.BoundedSemaphore(self.max_parsing)
+        closing = threading.Event()
+        stop = object()
+
+        def fetch(item):
+            try:
+                item.html = item.crawler.get_page(item.url(), 1)
+            except Exception as e:
+                results.put((item, None, 'fetch', e))
+                return
+            # Waits while the queue is full: this is the backpressure on the fetch stage.
+            while not closing.is_set():
+                try:
+                    fetched.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        def parsed(item, future):
+            parse_slots.release()
+            item.html = None
+            error = future.exception()
+            stage = 'pool' if isinstance(error, BrokenProcessPool) else 'parse'
+            results.put((item, None if error is not None else future.result(), stage, error))
+
+        def dispatch(parse_pool):
+            while True:
+                item = fetched.get()
+                if item is stop:
+                    return
+                parse_slots.acquire()
+                func, args = item.parse_call()
+                try:
+                    future = parse_pool.submit(func, *args)
+                except Exception as e:
+                    # The pool is broken (e.g. a worker died); the main loop raises instead of waiting forever.
+                    parse_slots.release()
+                    results.put((item, None, 'pool', e))
+                    return
+                future.add_done_callback(lambda future, item=item: parsed(item, future))
+
+        with ProcessPoolExecutor(self.parse_workers, mp_context=parse_context()) as parse_pool, \
+                ThreadPoolExecutor(self.fetch_workers) as fetch_pool:
+            crawlers = self.engine.make_crawlers(self.engine.plan(jobs, fetch_pool), None)
+            dispatcher = threading.Thread(target=dispatch, args=(parse_pool,), daemon=True)
+            dispatcher.start()
+            outstanding = 0
+            for crawler in crawlers:
+                crawler.no_items = False
+                crawler.complete = True
+                crawler.failed_pages = []
+                fetch_pool.submit(fetch, page_item(crawler, 0))
+                outstanding += 1
+            try:
+                while outstanding:
+                    item, result, stage, error = results.get()
+                    if stage == 'pool':
+                        raise error
+                    outstanding -= 1
+                    crawler = item.crawler
+                    if error is not None and (item.offset or stage == 'fetch'):
+                        # A page that could not be fetched or parsed is fetched again, like iter_listing_pages().
+                        if item.attempt < crawler.page_retries:
+                            fetch_pool.submit(fetch, page_item(crawler, item.offset, item.attempt + 1))
+                            outstanding += 1
+                        else:
+                            crawler.page_failed(item.url())
+                        continue
+                    if error is not None:
+                        # The first page could not be parsed, i.e. it has no products on it.
+                        crawler.no_items = True
+                        yield crawler, None
+                        continue
+                    if not item.offset:
+                        offsets, result = result
+                        for offset in offsets:
+                            fetch_pool.submit(fetch, page_item(crawler, offset))
+                            outstanding += 1
+                    yield crawler, (item.offset, result)
+                # Jobs with failed pages are reported like in crawl_engine.run().
+                self.engine.check_complete(crawlers)
+            finally:
+                closing.set()
+                fetch_pool.shutdown(wait=False, cancel_futures=True)
+                while dispatcher.is_alive():
+                    try:
+                        fetched.put(stop, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                dispatcher.join()
+
+    def run(self, jobs):
+        '''Crawl the jobs and return the combined typed result, one job after the other and pages in order.'''
+        pages = defaultdict(list)
+        crawlers = []
+        for crawler, page in self.iter_pages(jobs):
+            if crawler not in pages:
+                crawlers.append(crawler)
+            pages[crawler].append(page)
+        plan = self.engine.last_plan
+        order = {job: i for i, (job, _) in enumerate(plan.listings)}
+        # One frame per listing crawl of the plan, spread over the requested jobs like crawl_engine.run().
+        frames = [None] * len(plan.listings)
+        for crawler in crawlers:
+            i = order[(crawler.department, crawler.sub_department, crawler.brand, crawler.location)]
+            if crawler.no_items:
+                frames[i] = result_schema.empty_result(crawler.department, crawler.sub_department, crawler.location)
+                continue
+            columns = ([], [], [], [], [])
+            for offset, page in sorted(pages[crawler], key=lambda page: page[0]):
+                for column, values in zip(columns, page):
+                    column.extend(values)
+            frames[i] = result_schema.build_result_df(crawler.department, crawler.sub_department, crawler.location,
+                                                      *columns)
+        return result_schema.concat_results(plan.per_job(frames))
+
+    def stream(self, jobs, sink):
+        '''Crawl the jobs and hand every parsed page to sink.write() as soon as it is ready.'''
+        for crawler, page in self.iter_pages(jobs):
+            sink.write(crawler.no_items_records() if page is None else crawler.make_records(page[1]))
+        sink.flush()
+        return sink
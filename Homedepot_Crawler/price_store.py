@@ -0,0 +1,144 @@
+# coding: utf-8
+#!/usr/bin/env python
+"""Provides a local product and price store for incremental (delta) crawling.
+
+The price_store class keeps every product seen per store location in SQLite, keyed by the product link that
+get_prod_info() extracts, with its price, savings and first/last seen time. It also remembers a content hash and
+the product links of every listing page, so a delta crawl can skip parsing pages that did not change and still
+know which products are on them. apply() records one crawled job and returns only the new, removed and re-priced
+products.
+"""
+
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    url TEXT NOT NULL,
+    location TEXT NOT NULL,
+    job_key TEXT NOT NULL,
+    department TEXT,
+    sub_department TEXT,
+    brand TEXT,
+    description TEXT,
+    price REAL,
+    saving REAL,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    removed INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (url, location)
+);
+CREATE INDEX IF NOT EXISTS products_job ON products (job_key, removed, last_seen);
+CREATE TABLE IF NOT EXISTS pages (
+    page_key TEXT PRIMARY KEY,
+    content_hash TEXT NOT NULL,
+    product_urls TEXT NOT NULL,
+    fetched_at REAL NOT NULL
+);
+"""
+
+
+PRODUCTS_START = re.compile(r'<div\b[^>]*\bid=["\']products["\']', re.I)
+DIV_TAG = re.compile(r'<(/?)div\b[^>]*>', re.I)
+
+
+# Only the div#products slice of a listing page is hashed: the rest of a live page carries per-request tokens and -
+# -widgets, so a hash of the whole page would change on every fetch. The slice is cut by counting div tags, without -
+# -parsing the page; a page without div#products is hashed whole.
+def products_slice(html):
+    match = PRODUCTS_START.search(html)
+    if match is None:
+        return html
+    depth = 0
+    for tag in DIV_TAG.finditer(html, match.start()):
+        depth += -1 if tag.group(1) else 1
+        if depth == 0:
+            return html[match.start():tag.end()]
+    return html[match.start():]
+
+
+def page_digest(html):
+    return hashlib.sha256(products_slice(html).encode('utf-8')).hexdigest()
+
+
+# Prices are compared in cents, so a float round trip never reports a product as re-priced.
+def cents(value):
+    return None if value is None else int(round(value * 100))
+
+
+# An example usage is like this:
+# [In]: store = price_store('prices.db')
+# [In]: changes_df = homedepot_crawler('Appliances', 'Dishwashers', 'LG', 10022).run_delta(store)
+class price_store:
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+    def page_hash(self, page_key):
+        '''The content hash recorded for a listing page, or None if it was never crawled.'''
+        with self._lock:
+            row = self.conn.execute('SELECT content_hash FROM pages WHERE page_key = ?', (page_key,)).fetchone()
+        return row[0] if row else None
+
+    # records are the product dicts of homedepot_crawler.make_records() from the changed pages; changed_pages maps -
+    # -page_key -> (content hash, product links) and unchanged_pages lists the page keys that were skipped, whose -
+    # -products are marked as seen. Removed products are only detected when the job was crawled completely, -
+    # -otherwise a failed page would look like every product on it had been taken off the shelf.
+    def apply(self, job_key, location, records, changed_pages, unchanged_pages, seen_at=None, complete=True):
+        '''Record one crawled job and return the list of new, removed and re-priced products.'''
+        seen_at = time.time() if seen_at is None else seen_at
+        location_key = str(location)
+        changes = []
+        with self._lock, self.conn:
+            for record in records:
+                url = record["Product link"]
+                row = self.conn.execute('SELECT price, saving, removed FROM products WHERE url = ? AND location = ?',
+                                        (url, location_key)).fetchone()
+                if row is None or row[2]:
+                    changes.append(dict(record, Change='new', **{"Previous price": None}))
+                elif cents(row[0]) != cents(record["Current price"]) or cents(row[1]) != cents(record["Price saving"]):
+                    changes.append(dict(record, Change='repriced', **{"Previous price": row[0]}))
+                self.conn.execute(
+                    'INSERT INTO products (url, location, job_key, department, sub_department, brand, description, '
+                    'price, saving, first_seen, last_seen, removed) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0) '
+                    'ON CONFLICT (url, location) DO UPDATE SET job_key = excluded.job_key, brand = excluded.brand, '
+                    'description = excluded.description, price = excluded.price, saving = excluded.saving, '
+                    'last_seen = excluded.last_seen, removed = 0',
+                    (url, location_key, job_key, record["Department"], record["Sub Department"], record["Brand"],
+                     record["Description"], record["Current price"], record["Price saving"], seen_at, seen_at))
+            for page_key, (content_hash, urls) in changed_pages.items():
+                self.conn.execute('INSERT OR REPLACE INTO pages (page_key, content_hash, product_urls, fetched_at) '
+                                  'VALUES (?, ?, ?, ?)', (page_key, content_hash, json.dumps(urls), seen_at))
+            for page_key in unchanged_pages:
+                row = self.conn.execute('SELECT product_urls FROM pages WHERE page_key = ?', (page_key,)).fetchone()
+                if row is None:
+                    continue
+                self.conn.executemany('UPDATE products SET last_seen = ? WHERE url = ? AND location = ?',
+                                      [(seen_at, url, location_key) for url in json.loads(row[0])])
+                self.conn.execute('UPDATE pages SET fetched_at = ? WHERE page_key = ?', (seen_at, page_key))
+            if complete:
+                for row in self.conn.execute(
+                        'SELECT url, department, sub_department, brand, description, price, saving FROM products '
+                        'WHERE job_key = ? AND location = ? AND removed = 0 AND last_seen < ?',
+                        (job_key, location_key, seen_at)).fetchall():
+                    changes.append({"Department": row[1], "Sub Department": row[2], "Current price": None,
+                                    "Price saving": None, "Brand": row[3], "Description": row[4],
+                                    "Product link": row[0], "Location": location, "Change": 'removed',
+                                    "Previous price": row[5]})
+                self.conn.execute('UPDATE products SET removed = 1 WHERE job_key = ? AND location = ? AND removed = 0 '
+                                  'AND last_seen < ?', (job_key, location_key, seen_at))
+        return changes
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
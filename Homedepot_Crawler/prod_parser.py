@@ -0,0 +1,195 @@
+# coding: utf-8
+#!/usr/bin/env python
+"""Provides fast product extractors for homedepot.com listing and product detail pages.
+
+extract_prod_info() returns the same five lists as homedepot_crawler.get_prod_info() (current prices, price
+savings, brands, descriptions and product links), but it works on the raw html with lxml instead of a full
+BeautifulSoup tree. Only the div#products subtree is walked, all fields are collected in one pass over it, and
+attributes are read directly instead of re-serializing every anchor to run a regex on it.
+extract_product_details() reads rating, review count, model, SKU and availability from a product page.
+"""
+
+import json
+import re
+
+from lxml import html as lxml_html
+
+
+SITE_URL = "https://www.homedepot.com"
+# Pages are handed to lxml as utf-8 bytes, so a <meta charset> in the page must not change how they are decoded.
+HTML_PARSER = lxml_html.HTMLParser(encoding='utf-8')
+
+
+def has_class(element, name):
+    return name in (element.get('class') or '').split()
+
+
+# Same conversions as get_prod_info(): "$1,23499" -> 1234.99, and the first "dd.dd" in the savings text or 0.0.
+def parse_price(text):
+    text = text.strip()
+    return float((text[:-2] + '.' + text[-2:]).strip("$").replace(',', ''))
+
+
+def parse_saving(text):
+    match = re.search(r'[0-9]+(\.[0-9]{2})', text.strip())
+    return float(match.group()) if match else float(0.00)
+
+
+def parse_tree(page):
+    if isinstance(page, str):
+        page = page.encode('utf-8')
+    return lxml_html.fromstring(page, parser=HTML_PARSER)
+
+
+# A product anchor is <a data-pod-type="pr">, its brand is the first span.pod-plp__brand-name inside it.
+# Like get_prod_info(), a page without div#products or an anchor without a brand raises, so run() can treat -
+# -the page as "No items on display".
+def extract_prod_info(page, site_url=SITE_URL):
+    '''Parse a listing page (html text or an lxml tree) into prices, savings, brands, descriptions and links.'''
+    tree = parse_tree(page) if isinstance(page, (str, bytes)) else page
+    products = tree.xpath('//div[@id="products"]')
+    if not products:
+        raise ValueError('no div#products on the page')
+    price_current, price_savings, prod_brand, prod_desc, prod_url = [], [], [], [], []
+    for element in products[0].iter():
+        tag = element.tag
+        if tag == 'a' and element.get('data-pod-type') == 'pr':
+            brand = next((span for span in element.iter('span') if has_class(span, 'pod-plp__brand-name')), None)
+            if brand is None:
+                raise ValueError('no brand in the product anchor {}'.format(element.get('href')))
+            prod_url.append(site_url + element.get('href'))
+            prod_brand.append(brand.text_content())
+            prod_desc.append(element.text_content().strip().split('\n')[-1])
+        elif tag == 'div' and has_class(element, 'price__numbers'):
+            price_current.append(parse_price(element.text_content()))
+        elif tag == 'div' and has_class(element, 'info__savings'):
+            price_savings.append(parse_saving(element.text_content()))
+    return price_current, price_savings, prod_brand, prod_desc, prod_url
+
+
+# The page numbers in the pagination bar at the bottom of a listing page; an empty list for a single page.
+def extract_page_numbers(page):
+    tree = parse_tree(page) if isinstance(page, (str, bytes)) else page
+    links = [a for a in tree.iter('a') if has_class(a, 'hd-pagination__link')]
+    return [int(a.text_content()) for a in links if a.text_content() != '']
+
+
+def extract_listing(page, site_url=SITE_URL):
+    '''Parse a listing page once and return (page numbers, product info).'''
+    tree = parse_tree(page)
+    return extract_page_numbers(tree), extract_prod_info(tree, site_url)
+
+
+# The "Nao" offsets of the other pages of a listing, from the page numbers in its pagination bar.
+def listing_offsets(page_ls):
+    return list(range(24, (max(page_ls)+2)*12, 12)) if page_ls != [] else []
+
+
+# The total number of results in the "load more" box (the last number in div#load-more), or None if the page has -
+# -no "load more" button.
+def extract_load_more_total(page):
+    tree = parse_tree(page) if isinstance(page, (str, bytes)) else page
+    boxes = tree.xpath('//div[@id="load-more"]')
+    if not boxes:
+        return None
+    return [int(span.text_content()) for span in boxes[0].iter('span')][-1]
+
+
+def extract_load_more_listing(page, site_url=SITE_URL):
+    '''Parse a "load more" listing page once and return (total results or None, product info).'''
+    tree = parse_tree(page)
+    return extract_load_more_total(tree), extract_prod_info(tree, site_url)
+
+
+# The "Nao" offsets of the other pages of a "load more" listing, from its total number of results.
+def load_more_offsets(max_result_num, page_size=24):
+    return [] if max_result_num is None else list(range(page_size, max_result_num, page_size))
+
+
+# extract_first_page() is a plain module-level function, so it can run in a process pool: it returns the offsets -
+# -of the other pages and the product info of the first page, like homedepot_crawler.parse_first_page().
+def extract_first_page(page, site_url=SITE_URL, load_more=False, page_size=24):
+    '''Parse the first page of a listing into (offsets of the other pages, product info).'''
+    if load_more:
+        max_result_num, info = extract_load_more_listing(page, site_url)
+        return load_more_offsets(max_result_num, page_size), info
+    page_ls, info = extract_listing(page, site_url)
+    return listing_offsets(page_ls), info
+
+
+DETAIL_FIELDS = ("Rating", "Review count", "Model", "SKU", "Availability")
+# schema.org property of each detail field, for pages that use microdata (itemprop) instead of JSON-LD.
+DETAIL_ITEMPROPS = {"Rating": "ratingValue", "Review count": "reviewCount", "Model": "model", "SKU": "sku",
+                    "Availability": "availability"}
+
+
+# The first number in the value: "4.3" -> 4.3, "(1,287)" -> 1287.0, None or "" -> None.
+def to_float(value):
+    match = re.search(r'[0-9][0-9,]*(\.[0-9]+)?', str(value)) if value is not None else None
+    return float(match.group().replace(',', '')) if match else None
+
+
+def to_int(value):
+    number = to_float(value)
+    return None if number is None else int(number)
+
+
+# "http://schema.org/InStock" -> "InStock"
+def short_availability(value):
+    if not value:
+        return None
+    return str(value).rstrip('/').rsplit('/', 1)[-1]
+
+
+def iter_json_ld(tree):
+    for script in tree.xpath('//script[@type="application/ld+json"]'):
+        try:
+            data = json.loads(script.text_content())
+        except ValueError:
+            continue
+        items = data if isinstance(data, list) else data.get('@graph', [data]) if isinstance(data, dict) else []
+        for item in items:
+            if isinstance(item, dict):
+                yield item
+
+
+def first(value):
+    return value[0] if isinstance(value, list) and value else value
+
+
+# The Product object of the page's JSON-LD is read first; fields it does not have are looked up as itemprop -
+# -microdata. A field that is on neither is None.
+def extract_product_details(page):
+    '''Parse a product page into a dict of Rating, Review count, Model, SKU and Availability.'''
+    tree = parse_tree(page) if isinstance(page, (str, bytes)) else page
+    details = dict.fromkeys(DETAIL_FIELDS)
+    for item in iter_json_ld(tree):
+        if 'Product' not in (item.get('@type') if isinstance(item.get('@type'), list) else [item.get('@type')]):
+            continue
+        rating = item.get('aggregateRating') or {}
+        offers = first(item.get('offers')) or {}
+        model = item.get('model') or item.get('mpn')
+        details["Rating"] = to_float(rating.get('ratingValue'))
+        details["Review count"] = to_int(rating.get('reviewCount') or rating.get('ratingCount'))
+        details["Model"] = model.get('name') if isinstance(model, dict) else model
+        details["SKU"] = item.get('sku') or item.get('productID')
+        details["Availability"] = short_availability(offers.get('availability'))
+        break
+    for field, prop in DETAIL_ITEMPROPS.items():
+        if details[field] is not None:
+            continue
+        nodes = tree.xpath('//*[@itemprop="{}"]'.format(prop))
+        if not nodes:
+            continue
+        value = nodes[0].get('content') or nodes[0].get('href') or nodes[0].text_content().strip()
+        if field == "Rating":
+            value = to_float(value)
+        elif field == "Review count":
+            value = to_int(value)
+        elif field == "Availability":
+            value = short_availability(value)
+        details[field] = None if value == '' else value
+    for field in ("Model", "SKU"):
+        if details[field] is not None:
+            details[field] = str(details[field])
+    return details
@@ -0,0 +1,185 @@
+# coding: utf-8
+#!/usr/bin/env python
+"""Provides a cached, health-scored proxy pool for the homedepot crawler.
+
+The proxy_pool class loads the free proxy list once, refreshes it in the background when it is older than the ttl,
+and tracks success rate and latency for every proxy so that the crawler is always handed the fastest healthy one.
+Dead proxies are evicted from the pool instead of being picked again on the next request. A proxy that works but
+is refused by the site (throttled or blocked) has its circuit breaker tripped instead: it is skipped for a
+cooldown that doubles with every trip, then one probe request decides whether it is closed again.
+"""
+
+import random
+import threading
+import time
+
+
+# The health record kept for every proxy in the pool. Latency is an exponentially weighted moving average so -
+# -one slow response does not push a good proxy to the bottom of the list.
+class proxy_stats:
+
+    def __init__(self):
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.latency = None
+        # Circuit breaker: open while time.time() < open_until; trips > 0 means the next pick is a probe.
+        self.open_until = 0.0
+        self.trips = 0
+
+    def attempts(self):
+        return self.successes + self.failures
+
+    def success_rate(self):
+        if self.attempts() == 0:
+            return 1.0
+        return self.successes / self.attempts()
+
+
+# The loader is any callable returning a list of "ip:port" strings, e.g. homedepot_site_map.gatherproxy_resp.
+# Passing in a loader (instead of hard-coding gatherproxy) lets us test the pool against a local stand-in list.
+# An example usage is like this:
+# [In]: pool = proxy_pool(lambda: ['127.0.0.1:8080', '127.0.0.1:8081'])
+# [In]: proxy = pool.get_proxy()
+# [In]: pool.report(proxy, True, 0.35)
+class proxy_pool:
+
+    def __init__(self, loader, ttl=600, max_failures=3, min_success_rate=0.3, min_samples=5,
+                 eviction_ttl=3600, explore=0.1, alpha=0.3, max_cooldown=3600, probe_timeout=60):
+        self.loader = loader
+        self.ttl = ttl
+        self.max_failures = max_failures
+        self.min_success_rate = min_success_rate
+        self.min_samples = min_samples
+        self.eviction_ttl = eviction_ttl
+        self.explore = explore
+        self.alpha = alpha
+        self.max_cooldown = max_cooldown
+        self.probe_timeout = probe_timeout
+        self.stats = {}
+        self.evicted = {}
+        self.loaded_at = None
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._refreshing = False
+
+    def __len__(self):
+        with self._lock:
+            return len(self.stats)
+
+    # Merge a freshly loaded proxy list into the pool. Proxies we already know keep their history, proxies that -
+    # -dropped off the list are forgotten, and recently evicted proxies stay out until eviction_ttl has passed.
+    def _merge(self, proxies):
+        now = time.time()
+        with self._lock:
+            self.evicted = {p: t for p, t in self.evicted.items() if now - t < self.eviction_ttl}
+            self.stats = {p: self.stats.get(p) or proxy_stats() for p in proxies if p not in self.evicted}
+            self.loaded_at = now
+
+    def refresh(self):
+        '''Reload the proxy list synchronously. An empty or failed load keeps the current list.'''
+        try:
+            proxies = self.loader()
+        except Exception:
+            proxies = []
+        if proxies:
+            self._merge(proxies)
+        elif self.loaded_at is None:
+            with self._lock:
+                self.loaded_at = time.time()
+        return len(self)
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    # The first call loads the list in the foreground; concurrent first callers wait for that one load instead of -
+    # -each downloading the list. After that, a stale list keeps serving requests while a daemon thread fetches -
+    # -the new one, so no page fetch has to wait for gatherproxy.
+    def _ensure_fresh(self):
+        if self.loaded_at is None:
+            with self._load_lock:
+                if self.loaded_at is None:
+                    self.refresh()
+            return
+        with self._lock:
+            if self._refreshing or time.time() - self.loaded_at < self.ttl:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh_in_background, daemon=True).start()
+
+    def is_healthy(self, stats):
+        if stats.consecutive_failures >= self.max_failures:
+            return False
+        if stats.attempts() >= self.min_samples and stats.success_rate() < self.min_success_rate:
+            return False
+        return True
+
+    def get_proxy(self):
+        '''Return the fastest healthy proxy ("ip:port") whose breaker is closed, or None if there is none.'''
+        self._ensure_fresh()
+        with self._lock:
+            now = time.time()
+            closed = {p: s for p, s in self.stats.items() if s.open_until <= now}
+            if not closed:
+                return None
+            # A proxy whose cooldown ran out gets exactly one probe request: it stays open until the probe reports.
+            probes = [p for p, s in closed.items() if s.trips]
+            if probes:
+                proxy = random.choice(probes)
+                closed[proxy].open_until = now + self.probe_timeout
+                return proxy
+            measured = [(s.latency, p) for p, s in closed.items() if s.latency is not None]
+            # Once a proxy has a latency, the fastest one is handed out and only the explore share of picks tries -
+            # -something else: preferably a proxy never tried, so the list is explored a few picks at a time, and -
+            # -otherwise any proxy, so one that was slow (or failed) once gets a chance to prove itself again.
+            # Until then the untried proxies are tried first; a proxy that failed without ever succeeding has no -
+            # -latency, but it is not untried any more.
+            untried = [p for p, s in closed.items() if s.attempts() == 0]
+            if not measured:
+                return random.choice(untried or list(closed))
+            if random.random() < self.explore:
+                return random.choice(untried or list(closed))
+            return min(measured)[1]
+
+    def report(self, proxy, success, latency=None):
+        '''Record the outcome of one request through proxy and evict it if it is no longer healthy.'''
+        if proxy is None:
+            return
+        with self._lock:
+            stats = self.stats.get(proxy)
+            if stats is None:
+                return
+            if success:
+                stats.successes += 1
+                stats.consecutive_failures = 0
+                stats.trips = 0
+                stats.open_until = 0.0
+                if latency is not None:
+                    if stats.latency is None:
+                        stats.latency = latency
+                    else:
+                        stats.latency = self.alpha * latency + (1 - self.alpha) * stats.latency
+            else:
+                stats.failures += 1
+                stats.consecutive_failures += 1
+            if not self.is_healthy(stats):
+                del self.stats[proxy]
+                self.evicted[proxy] = time.time()
+
+    def trip(self, proxy, cooldown=60):
+        '''Open the circuit breaker of a proxy the site refused, for cooldown * 2 ** (earlier trips) seconds.'''
+        with self._lock:
+            stats = self.stats.get(proxy)
+            if stats is None:
+                return
+            stats.open_until = time.time() + min(self.max_cooldown, cooldown * 2 ** stats.trips)
+            stats.trips += 1
+
+    def snapshot(self):
+        '''Return {proxy: (success_rate, latency, attempts)} for monitoring.'''
+        with self._lock:
+            return {p: (s.success_rate(), s.latency, s.attempts()) for p, s in self.stats.items()}
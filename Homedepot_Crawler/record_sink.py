@@ -0,0 +1,112 @@
+# coding: utf-8
+#!/usr/bin/env python
+"""Provides streaming sinks that append product records to CSV or Parquet as they arrive.
+
+A sink buffers records until batch_size of them are waiting and then appends that batch to the output file, so a
+crawl never holds more than one batch (plus the page being parsed) in memory, and a crash only loses the batch
+that was not written yet. Parquet output needs pyarrow; CSV output only needs pandas.
+"""
+
+import os
+import threading
+
+import pandas as pd
+
+
+# Every sink can be used as a context manager, and write() is safe to call from several crawler threads.
+# An example usage is like this:
+# [In]: with csv_sink("result_df.csv", batch_size=5000) as sink:
+# [In]:     for records in crawler.iter_pages():
+# [In]:         sink.write(records)
+class record_sink:
+
+    # frame_builder turns a list of records into a dataframe, e.g. result_schema.records_to_frame for typed output.
+    def __init__(self, path, columns=None, batch_size=5000, frame_builder=None):
+        self.path = path
+        self.columns = columns
+        self.frame_builder = frame_builder
+        self.batch_size = batch_size
+        self.buffer = []
+        self.rows_written = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, records):
+        '''Add a list of record dicts; a full batch is appended to the output right away.'''
+        with self._lock:
+            self.buffer.extend(records)
+            if len(self.buffer) >= self.batch_size:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if not self.buffer:
+            return
+        if self.frame_builder is not None:
+            batch = self.frame_builder(self.buffer)
+        else:
+            batch = pd.DataFrame(self.buffer, columns=self.columns)
+        if self.columns is None:
+            self.columns = list(batch.columns)
+        self.append(batch)
+        self.rows_written += len(batch)
+        self.buffer = []
+
+    def append(self, batch):
+        raise NotImplementedError
+
+    def close(self):
+        self.flush()
+
+
+# The header is written with the first batch; appending to an existing file (e.g. from a resumed run) does not -
+# -repeat it.
+class csv_sink(record_sink):
+
+    def __init__(self, path, columns=None, batch_size=5000, frame_builder=None, overwrite=True):
+        super().__init__(path, columns, batch_size, frame_builder)
+        if overwrite and os.path.exists(path):
+            os.remove(path)
+
+    def append(self, batch):
+        header = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        batch.to_csv(self.path, mode='a', header=header, index=False)
+
+
+# Each batch becomes one row group of the same Parquet file. The schema is taken from the first batch, so later -
+# -batches are cast to it; pass result_schema.arrow_schema() to keep the dictionary-encoded result columns.
+class parquet_sink(record_sink):
+
+    def __init__(self, path, columns=None, batch_size=5000, frame_builder=None, schema=None):
+        super().__init__(path, columns, batch_size, frame_builder)
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("parquet_sink needs pyarrow: pip install pyarrow")
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.schema = schema
+        self.writer = None
+
+    def append(self, batch):
+        table = self.pa.Table.from_pandas(batch, schema=self.schema, preserve_index=False)
+        if self.writer is None:
+            self.schema = table.schema
+            self.writer = self.pq.ParquetWriter(self.path, self.schema)
+        self.writer.write_table(table.cast(self.schema))
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
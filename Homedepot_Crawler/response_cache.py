@@ -0,0 +1,136 @@
+# coding: utf-8
+#!/usr/bin/env python
+"""Provides an on-disk HTTP response cache with an offline replay mode for the homedepot crawler.
+
+The response_cache class stores page bodies content-addressed by url, query params (browsestoreoption, Nao) and
+store cookie. Entries expire after a ttl, the cache is kept under max_bytes by evicting the least recently used
+entries, and bodies can be stored gzip-compressed. In replay mode every page is served from disk and a page that
+was never recorded raises cache_miss instead of touching the network.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+class cache_miss(LookupError):
+    '''Raised in replay mode when a page is not in the cache.'''
+
+
+# An example usage is like this:
+# [In]: homedepot_site_map.response_cache = response_cache('cache', ttl=24*3600, max_bytes=2*1024**3, compress=True)
+# [In]: homedepot_site_map.response_cache = response_cache('cache', replay=True)   # rerun parsing with no network
+class response_cache:
+
+    def __init__(self, root, ttl=None, max_bytes=None, compress=False, replay=False):
+        self.root = root
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.replay = replay
+        self._lock = threading.Lock()
+        # key -> [path, size, last access]. Built once from the files on disk, then kept up to date in memory.
+        self.index = {}
+        self.total_bytes = 0
+        os.makedirs(root, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(dirpath, name)
+                st = os.stat(path)
+                self.index[name.split('.')[0]] = [path, st.st_size, st.st_mtime]
+                self.total_bytes += st.st_size
+
+    # The store cookie is part of the key because the same listing url returns different products per store.
+    def make_key(self, url, params=None, cookies=None):
+        parts = {'url': url, 'params': sorted((params or {}).items()), 'cookies': sorted((cookies or {}).items())}
+        return hashlib.sha256(json.dumps(parts, default=str).encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        suffix = '.html.gz' if self.compress else '.html'
+        return os.path.join(self.root, key[:2], key + suffix)
+
+    def _read(self, path):
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8') as f:
+            meta = json.loads(f.readline())
+            return meta, f.read()
+
+    def _drop(self, key):
+        path, size, _ = self.index.pop(key)
+        self.total_bytes -= size
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    # An entry read outside the lock is only dropped if a put() did not replace it meanwhile.
+    def _drop_entry(self, key, entry):
+        with self._lock:
+            if self.index.get(key) is entry:
+                self._drop(key)
+
+    # Only the index lookup and updates hold the lock; the file is read (and gunzipped) outside it, so cached -
+    # -reads of a concurrent crawl run in parallel.
+    def get(self, url, params=None, cookies=None):
+        '''Return the cached body, or None on a miss. In replay mode a miss raises cache_miss.'''
+        key = self.make_key(url, params, cookies)
+        with self._lock:
+            entry = self.index.get(key)
+        if entry is not None:
+            try:
+                meta, body = self._read(entry[0])
+            except (OSError, ValueError):
+                self._drop_entry(key, entry)
+                meta = None
+            # Expired entries are still good enough for an offline replay.
+            if meta is not None and (self.replay or self.ttl is None or time.time() - meta['created'] < self.ttl):
+                with self._lock:
+                    entry[2] = time.time()
+                try:
+                    os.utime(entry[0])
+                except OSError:
+                    pass
+                return body
+            if meta is not None:
+                self._drop_entry(key, entry)
+        if self.replay:
+            raise cache_miss('{} {} is not in the replay cache'.format(url, params or {}))
+        return None
+
+    # Entries are written to a temporary file and renamed into place, so a crashed run never leaves half a page.
+    def put(self, url, body, params=None, cookies=None):
+        key = self.make_key(url, params, cookies)
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = '{}.{}.tmp'.format(path, threading.get_ident())
+        opener = gzip.open if self.compress else open
+        with opener(tmp, 'wt', encoding='utf-8') as f:
+            f.write(json.dumps({'url': url, 'params': params or {}, 'created': time.time()}) + '\n')
+            f.write(body)
+        os.replace(tmp, path)
+        size = os.path.getsize(path)
+        with self._lock:
+            if key in self.index:
+                old_path, old_size, _ = self.index[key]
+                self.total_bytes -= old_size
+                if old_path != path and os.path.exists(old_path):
+                    os.remove(old_path)
+            self.index[key] = [path, size, time.time()]
+            self.total_bytes += size
+            self._evict()
+
+    def _evict(self):
+        if self.max_bytes is None or self.total_bytes <= self.max_bytes:
+            return
+        for key, _ in sorted(self.index.items(), key=lambda item: item[1][2]):
+            if self.total_bytes <= self.max_bytes:
+                break
+            self._drop(key)
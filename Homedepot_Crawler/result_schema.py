@@ -0,0 +1,129 @@
+# coding: utf-8
+#!/usr/bin/env python
+"""Provides the typed result schema of the homedepot crawler.
+
+Department, Sub Department, Brand and Location repeat on almost every row, so they are stored as categorical
+(dictionary-encoded) columns; prices are float32; Description and Product link are pandas strings. A job with
+nothing on display is marked by one row with "On display" False and empty data columns, instead of the
+"No items on display" sentinel strings. Frames are built straight from the parser's column lists. Product details
+(enrichment.py) have their own small table keyed by Product link, joined onto the result with join_details().
+"""
+
+import numpy as np
+import pandas as pd
+
+
+DIMENSIONS = ["Department", "Sub Department", "Brand", "Location"]
+PRICES = ["Current price", "Price saving"]
+TEXTS = ["Description", "Product link"]
+COLUMNS = ["Department", "Sub Department", "Current price", "Price saving", "Brand", "Description",
+           "Product link", "Location", "On display"]
+PRICE_DTYPE = np.float32
+DETAIL_COLUMNS = ["Product link", "Rating", "Review count", "Model", "SKU", "Availability"]
+
+
+# A column holding one value n times is stored as a single category plus n zero codes.
+def repeat_categorical(value, n):
+    if value is None:
+        return pd.Categorical.from_codes(np.full(n, -1, dtype=np.int8), categories=[])
+    return pd.Categorical.from_codes(np.zeros(n, dtype=np.int8), categories=[value])
+
+
+def build_result_df(department, sub_department, location, price_current, price_savings, prod_brand, prod_desc,
+                    prod_url):
+    '''Build the typed result of one job from the five column lists returned by the parser.'''
+    n = len(price_current)
+    return pd.DataFrame({
+        "Department": repeat_categorical(department, n),
+        "Sub Department": repeat_categorical(sub_department, n),
+        "Current price": np.asarray(price_current, dtype=PRICE_DTYPE),
+        "Price saving": np.asarray(price_savings, dtype=PRICE_DTYPE),
+        "Brand": pd.Categorical(prod_brand),
+        "Description": pd.array(prod_desc, dtype="string"),
+        "Product link": pd.array(prod_url, dtype="string"),
+        "Location": repeat_categorical(location, n),
+        "On display": np.ones(n, dtype=bool),
+    }, columns=COLUMNS)
+
+
+def empty_result(department, sub_department, location):
+    '''The explicit "nothing on display" marker: one row with On display False and no product data.'''
+    return pd.DataFrame({
+        "Department": repeat_categorical(department, 1),
+        "Sub Department": repeat_categorical(sub_department, 1),
+        "Current price": np.full(1, np.nan, dtype=PRICE_DTYPE),
+        "Price saving": np.full(1, np.nan, dtype=PRICE_DTYPE),
+        "Brand": pd.Categorical([None]),
+        "Description": pd.array([None], dtype="string"),
+        "Product link": pd.array([None], dtype="string"),
+        "Location": repeat_categorical(location, 1),
+        "On display": np.zeros(1, dtype=bool),
+    }, columns=COLUMNS)
+
+
+# Streaming sinks buffer record dicts; records_to_frame() gives their batches the same types as build_result_df().
+def records_to_frame(records):
+    df = pd.DataFrame(records, columns=COLUMNS)
+    return coerce(df)
+
+
+def coerce(df):
+    '''Cast a frame with the result columns to the result schema.'''
+    df = df.copy()
+    for column in DIMENSIONS:
+        df[column] = df[column].astype("category")
+    for column in PRICES:
+        df[column] = df[column].astype(PRICE_DTYPE)
+    for column in TEXTS:
+        df[column] = df[column].astype("string")
+    df["On display"] = df["On display"].fillna(True).astype(bool)
+    return df
+
+
+# pd.concat turns categoricals with different categories into object columns; the categories are unioned first -
+# -so the combined frame stays dictionary-encoded.
+def concat_results(frames):
+    frames = [f for f in frames if f is not None]
+    if not frames:
+        return build_result_df(None, None, None, [], [], [], [], [])
+    for column in DIMENSIONS:
+        # Frames without any category (e.g. the Brand of an empty result) are left out of the union.
+        seen = [f[column].cat.categories for f in frames if len(f[column].cat.categories)]
+        categories = seen[0].append(seen[1:]).unique() if seen else []
+        frames = [f.assign(**{column: f[column].cat.set_categories(categories)}) for f in frames]
+    return pd.concat(frames, axis=0, ignore_index=True)
+
+
+def arrow_schema():
+    '''The Parquet/Arrow schema of the result (needs pyarrow).'''
+    import pyarrow as pa
+    return pa.schema([
+        ("Department", pa.dictionary(pa.int32(), pa.string())),
+        ("Sub Department", pa.dictionary(pa.int32(), pa.string())),
+        ("Current price", pa.float32()),
+        ("Price saving", pa.float32()),
+        ("Brand", pa.dictionary(pa.int32(), pa.string())),
+        ("Description", pa.string()),
+        ("Product link", pa.string()),
+        ("Location", pa.dictionary(pa.int32(), pa.int64())),
+        ("On display", pa.bool_()),
+    ])
+
+
+# Rating is float32, Review count a nullable int, and Availability (a handful of schema.org values) categorical.
+def details_to_frame(records):
+    '''Build the typed product details table from detail record dicts.'''
+    df = pd.DataFrame(records, columns=DETAIL_COLUMNS)
+    df["Product link"] = df["Product link"].astype("string")
+    df["Rating"] = df["Rating"].astype(PRICE_DTYPE)
+    df["Review count"] = df["Review count"].astype("Int32")
+    df["Model"] = df["Model"].astype("string")
+    df["SKU"] = df["SKU"].astype("string")
+    df["Availability"] = df["Availability"].astype("category")
+    return df
+
+
+def join_details(result_df, details_df):
+    '''Add the detail columns to every result row of the same Product link (rows without details get nulls).'''
+    details_df = details_df.drop_duplicates("Product link").set_index("Product link")
+    return result_df.join(details_df, on="Product link")
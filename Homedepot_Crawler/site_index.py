@@ -0,0 +1,96 @@
+# coding: utf-8
+#!/usr/bin/env python
+"""Provides a persistent, shared index of the site map and brand dictionaries for the homedepot crawler.
+
+The site_index class keeps department -> sub_department -> url (the dep_dict built by homedepot_site_map.run())
+and category url -> brand -> url (the brand_dict built by homedepot_crawler.get_brand_dict()) in one versioned
+JSON file. Every entry has its own fetch time, so a stale entry is refreshed on its own when it is next used,
+and crawler instances in the same process share one copy instead of fetching the same brand page again.
+"""
+
+import json
+import os
+import threading
+import time
+
+
+# Bump INDEX_VERSION whenever the shape of dep_dict or brand_dict changes; older files are then ignored.
+INDEX_VERSION = 1
+
+
+# The loader passed to get_dep_dict()/get_brand_dict() is only called on a miss or for a stale entry.
+# An example usage is like this:
+# [In]: homedepot_site_map.site_index = site_index('site_index.json', ttl=7*24*3600)
+# [In]: dep_dict = homedepot_site_map().run()    # loaded from site_index.json if it is fresh
+# Passing path=None keeps the index in memory only, which still shares it across instances of one run.
+class site_index:
+
+    def __init__(self, path=None, ttl=7*24*3600):
+        self.path = path
+        self.ttl = ttl
+        self.data = {'version': INDEX_VERSION, 'dep_dict': None, 'brands': {}}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('version') == INDEX_VERSION:
+            self.data = data
+
+    # Written to a temporary file first and renamed, so readers in other processes never see half an index.
+    def save(self):
+        if self.path is None:
+            return
+        with self._lock:
+            payload = json.dumps(self.data)
+        tmp = '{}.{}.{}.tmp'.format(self.path, os.getpid(), threading.get_ident())
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(payload)
+        os.replace(tmp, self.path)
+
+    def is_fresh(self, entry):
+        return entry is not None and time.time() - entry['fetched'] < self.ttl
+
+    # One lock per key, so four crawlers asking for the same brand page at once cause a single fetch, while -
+    # -different brand pages are still fetched concurrently.
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _get(self, key, read, write, loader):
+        with self._key_lock(key):
+            entry = read()
+            if self.is_fresh(entry):
+                return entry['value']
+            value = loader()
+            with self._lock:
+                write({'fetched': time.time(), 'value': value})
+            self.save()
+            return value
+
+    def get_dep_dict(self, loader):
+        '''Return the department dict, calling loader() if it is missing or older than the ttl.'''
+        def write(entry):
+            self.data['dep_dict'] = entry
+        return self._get('dep_dict', lambda: self.data['dep_dict'], write, loader)
+
+    def get_brand_dict(self, source_url, loader):
+        '''Return the brand dict of the category at source_url, calling loader() if it is missing or stale.'''
+        def write(entry):
+            self.data['brands'][source_url] = entry
+        return self._get(('brands', source_url), lambda: self.data['brands'].get(source_url), write, loader)
+
+    def invalidate(self, source_url=None):
+        '''Drop one brand entry, or the whole index when source_url is None.'''
+        with self._lock:
+            if source_url is None:
+                self.data = {'version': INDEX_VERSION, 'dep_dict': None, 'brands': {}}
+            else:
+                self.data['brands'].pop(source_url, None)
+        self.save()